@@ -0,0 +1,169 @@
+"""
+AdmissionControl is a module containing the AdmissionControl, which
+decides when jobs may start so that a burst of requests can't overload
+the host or be monopolized by one user.
+
+Jobs start right away while there is room for them: fewer than
+max_running jobs running in total, and fewer than user_quota for their
+user and channel_quota for their channel. Other jobs wait in a bounded
+queue and are started in turn, one user at a time, as jobs finish.
+Jobs are turned away when the queue (or the user's share of it) is full.
+
+Copyright (c) 2016 Donald E. Willcox
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import time
+import threading
+from collections import deque, OrderedDict
+
+class AdmissionTicket(object):
+    def __init__(self, user, channel, start):
+        # User and channel the job is for
+        self.user = user
+        self.channel = channel
+
+        # Function called with this ticket to start the job
+        self.start = start
+
+        # Time the job was asked for
+        self.submit_time = time.time()
+
+class AdmissionControl(object):
+    def __init__(self, max_running, max_queued=100, user_quota=2, channel_quota=4,
+                 user_queued=10, metrics=None):
+        # Most jobs running at once, in total, for each user and for each channel
+        self.max_running = max(1, max_running)
+        self.user_quota = max(1, user_quota)
+        self.channel_quota = max(1, channel_quota)
+
+        # Most jobs waiting, in total and for each user
+        self.max_queued = max_queued
+        self.user_queued = user_queued
+
+        # Dict mapping users (keys) to deques of their waiting tickets (values),
+        # in the order users take turns
+        self.waiting = OrderedDict()
+        self.num_waiting = 0
+
+        # Running jobs in total and for each user and channel
+        self.num_running = 0
+        self.user_running = {}
+        self.channel_running = {}
+
+        self.lock = threading.Lock()
+
+        self.metrics = metrics
+        if self.metrics:
+            self.metrics.describe('artoo_admission_total', 'Jobs started right away, queued, or turned away.')
+            self.metrics.register_gauge('artoo_jobs_queued', lambda: self.num_waiting,
+                                        'Jobs waiting for their turn to run.')
+            self.metrics.register_gauge('artoo_jobs_running', lambda: self.num_running,
+                                        'Jobs admitted and running.')
+
+    def count(self, result):
+        # Count an admission decision in the metrics
+        if self.metrics:
+            self.metrics.increment('artoo_admission_total', result=result)
+
+    def can_start_locked(self, ticket):
+        # Returns True if ticket's job fits within every quota
+        return (self.num_running < self.max_running and
+                self.user_running.get(ticket.user, 0) < self.user_quota and
+                self.channel_running.get(ticket.channel, 0) < self.channel_quota)
+
+    def mark_running_locked(self, ticket):
+        # Count ticket's job as running
+        self.num_running += 1
+        self.user_running[ticket.user] = self.user_running.get(ticket.user, 0) + 1
+        self.channel_running[ticket.channel] = self.channel_running.get(ticket.channel, 0) + 1
+
+    def get_position_locked(self, user):
+        # Returns the place in line of the last job waiting for user: users
+        # take turns, so only as many jobs of each other user are ahead of it
+        # as this user has waiting
+        user_waiting = len(self.waiting.get(user, ()))
+        return user_waiting + sum(min(len(tickets), user_waiting)
+                                  for other, tickets in self.waiting.items() if other != user)
+
+    def submit(self, user, channel, start):
+        # Ask to run a job for user in channel, calling start(ticket) when it may run
+        # Returns ('started', 0), ('queued', position in line) or ('rejected', reason)
+        ticket = AdmissionTicket(user, channel, start)
+        with self.lock:
+            # Jobs already waiting get the first chance at any free room
+            ready = self.take_ready_locked()
+            if self.can_start_locked(ticket):
+                self.mark_running_locked(ticket)
+                ready.append(ticket)
+                result = ('started', 0)
+            elif self.num_waiting >= self.max_queued:
+                result = ('rejected', 'busy')
+            elif len(self.waiting.get(user, ())) >= self.user_queued:
+                result = ('rejected', 'user')
+            else:
+                self.waiting.setdefault(user, deque()).append(ticket)
+                self.num_waiting += 1
+                result = ('queued', self.get_position_locked(user))
+        self.count(result[0])
+        for ready_ticket in ready:
+            ready_ticket.start(ready_ticket)
+        return result
+
+    def finish(self, ticket):
+        # Record that ticket's job has finished and start waiting jobs
+        with self.lock:
+            self.num_running -= 1
+            for running, key in [(self.user_running, ticket.user), (self.channel_running, ticket.channel)]:
+                running[key] -= 1
+                if not running[key]:
+                    del running[key]
+            ready = self.take_ready_locked()
+        for ready_ticket in ready:
+            ready_ticket.start(ready_ticket)
+
+    def next_ticket_locked(self):
+        # Remove and return the next waiting ticket which may start, going
+        # through users in turn, or None if none can start yet
+        if self.num_running >= self.max_running:
+            return None
+        for user in list(self.waiting):
+            tickets = self.waiting[user]
+            for ticket in tickets:
+                if self.can_start_locked(ticket):
+                    tickets.remove(ticket)
+                    self.num_waiting -= 1
+                    # This user goes to the back of the line
+                    del self.waiting[user]
+                    if tickets:
+                        self.waiting[user] = tickets
+                    return ticket
+        return None
+
+    def take_ready_locked(self):
+        # Remove every waiting ticket which may start now, count them as
+        # running and return them in the order they should start
+        ready = []
+        ticket = self.next_ticket_locked()
+        while ticket is not None:
+            self.mark_running_locked(ticket)
+            ready.append(ticket)
+            ticket = self.next_ticket_locked()
+        return ready
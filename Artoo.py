@@ -30,151 +30,443 @@ OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 SOFTWARE.
 """
 
-import os
 import re
-from subprocess import Popen, PIPE, TimeoutExpired
-from tempfile import NamedTemporaryFile
+import sys
+import asyncio
+import hashlib
+import traceback
+from subprocess import run, PIPE, TimeoutExpired
 from SlackBot import SlackBotInterface
+from Sandbox import Sandbox
+from RemoteExecutor import RemoteExecutor
+from SessionPool import SessionPool
+from Cache import LRUCache, ResultCache
+from ProgressReply import ProgressReply
+
+# Code matching this RE depends on the time, randomness, or asks not to be
+# cached, so running it again may not give the same result
+RE_NOCACHE = re.compile(r'artoo:\s*nocache|\b(random|time|datetime|date|sleep|uuid|secrets)\b|urandom|\$RANDOM|\$SECONDS')
             
 class Artoo(SlackBotInterface):
-    def __init__(self, bot_id_file, watch_only, verbose):
+    def __init__(self, bot_id_file, watch_only, verbose, num_workers=4,
+                 warm_pool_size=0, prewarm_modules=(),
+                 cache_results=False, cache_ttl=3600, cache_bytes=64*1024*1024,
+                 stream_output=False, stream_interval=3, limits=None, use_sandbox=True,
+                 diskless=False, executor_address=None, executor_secret=None,
+                 max_sessions=4, session_idle_secs=900, session_memory=None,
+                 max_queued=100, user_quota=2, channel_quota=4, preflight=True,
+                 runtime=None, shared_from=None):
         # Initialize the SlackBotInterface
-        super(Artoo, self).__init__(bot_id_file, watch_only)
+        # Artoos for other workspaces in this process pass the first Artoo as
+        # shared_from, to share its job pool, admission control, metrics,
+        # sandbox, executor and sessions
+        super(Artoo, self).__init__(bot_id_file, watch_only, num_workers, shared_from)
 
         # Add Artoo's instructions to the instruction set
         self.instruction_set['help'] = self.ins_only_hope
         self.instruction_set['bash'] = self.ins_run_bash
         self.instruction_set['python'] = self.ins_run_python
+        self.instruction_set['stats'] = self.ins_stats
+        self.instruction_set['session'] = self.ins_session
+
+        # Instructions which run code wait their turn: at most user_quota jobs
+        # run for each user and channel_quota for each channel, and up to
+        # max_queued more wait, taking turns between users
+        self.admitted_instructions.update(['bash', 'python', 'session'])
+        self.admission.max_queued = max_queued
+        self.admission.user_quota = max(1, user_quota)
+        self.admission.channel_quota = max(1, channel_quota)
+
+        # The RE for session instructions is '[self.tag] session [action]'
+        self.re_session = self.tag + r'\s*session\s*(\w*)'
+
+        # Coroutine versions of the instructions that spawn processes
+        self.async_instruction_set['bash'] = self.async_ins_run_bash
+        self.async_instruction_set['python'] = self.async_ins_run_python
 
-        # Timeout for running external processes
-        self.PROC_TIMEOUT_SECS = 300 # 5 minutes
+        # Show output in Slack while processes run, updating every stream_interval seconds
+        self.stream_output = stream_output
+        self.stream_interval = stream_interval
 
         # Verbose status
         self.verbose = verbose
 
-        # Get the SELinux sandbox tmp directory and prepare run commands
-        self.artoo_dir = os.getcwd()
-        self.sbox_home = 'sbox_home'
-        self.sbox_home_dir = os.path.join(self.artoo_dir, self.sbox_home)
-        self.sbox_tmp  = 'tmp'
-        self.sbox_home_tmp  = os.path.join(self.sbox_home,self.sbox_tmp)
-        self.sbox_tmp_dir = os.path.join(self.artoo_dir, self.sbox_home_tmp)
-        self.se_sbox_run = ['sandbox', '-M',
-                            '-H', self.sbox_home,
-                            '-T', self.sbox_home_tmp]
+        # Sandbox which runs code in processes on this host, with the
+        # provisioned runtime named runtime (or sbox_anaconda if None)
+        # Without an executor address, it runs every job
+        if shared_from:
+            self.sandbox = shared_from.sandbox
+        else:
+            self.sandbox = Sandbox(self.metrics, verbose, limits, use_sandbox, diskless,
+                                   warm_pool_size if not executor_address else 0,
+                                   prewarm_modules, stream_interval, self.job_pool, runtime)
+
+        # Backend which runs jobs: the local sandbox, or executor workers
+        # connected from this or other hosts to executor_address (HOST:PORT)
+        self.executor = self.sandbox
+        if shared_from:
+            self.executor = shared_from.executor
+        elif executor_address:
+            self.executor = RemoteExecutor(executor_address, executor_secret, self.job_pool,
+                                           self.metrics, verbose,
+                                           proc_timeout=self.sandbox.PROC_TIMEOUT_SECS)
+
+        # Persistent python sessions, one for each user and channel, run on
+        # this host and ended after session_idle_secs idle or if all of them
+        # use more than session_memory bytes (disabled if max_sessions is 0)
+        self.session_pool = None
+        if shared_from:
+            self.session_pool = shared_from.session_pool
+        elif max_sessions > 0:
+            self.session_pool = SessionPool(self.sandbox, self.metrics, max_sessions,
+                                            session_idle_secs, session_memory, verbose)
+
+        # Cache of (stdout, stderr, exitcode, usage) keyed by interpreter, runtime and code
+        # Executor workers may each use a different runtime, which the key
+        # can't know before a job is run, so results aren't cached with them
+        self.result_cache = None
+        if cache_results and isinstance(self.executor, RemoteExecutor):
+            print('Result caching is disabled when running jobs on executor workers')
+        elif cache_results:
+            self.result_cache = ResultCache(max_bytes=cache_bytes, ttl_secs=cache_ttl,
+                                            sizeof=lambda result: len(result[0]) + len(result[1]))
+
+        # Check code before running it (if preflight is True): its size,
+        # python syntax and bash syntax, remembering the errors found by code hash
+        self.preflight = preflight
+        self.MAX_CODE_BYTES = 256*1024
+        self.SYNTAX_CHECK_TIMEOUT_SECS = 5
+        self.preflight_cache = LRUCache(max_entries=1024)
+        self.python_version_matches = None
+
+        self.metrics.describe('artoo_result_cache_total', 'Result cache lookups by outcome.')
+        self.metrics.describe('artoo_preflight_total', 'Code checked before running, by outcome.')
 
     def print_wrapper(self, to_print):
         # Wrapper for python print that checks verbosity status
         if self.verbose:
             print(to_print)
 
-    def form_se_cmd(self, program_cmd):
-        # Returns the Popen command for a SELinux sandboxed
-        sbox_run_cmd = self.se_sbox_run + program_cmd
-        self.print_wrapper(sbox_run_cmd)
-        return sbox_run_cmd
-
-    def open_process(self, program_cmd):
-        # Opens a subprocess using Popen
-        # Return STDOUT, STDERR, and EXITCODE
-        proc_env = os.environ.copy()
-        sbox_pypath = os.path.join(self.sbox_home_dir,'sbox_anaconda','bin')
-        proc_env['PATH'] = sbox_pypath + ':' + proc_env['PATH']
-        sbox_run_program = self.form_se_cmd(program_cmd)
-        proc = Popen(sbox_run_program, stdout=PIPE, stderr=PIPE, env=proc_env)
+    def format_usage(self, usage):
+        # Returns a one line description of a job's resource usage
+        return self.sandbox.format_usage(usage)
+
+    def run_code(self, interpreter, code, progress=None):
+        # Execute code with interpreter on the executor backend
+        # Return STDOUT, STDERR, EXITCODE, and resource USAGE
+        return self.executor.run_code(interpreter, code, progress)
+
+    async def async_run_code(self, interpreter, code, progress=None):
+        # Event loop version of run_code
+        return await self.executor.async_run_code(interpreter, code, progress)
+
+    def get_runtime_version(self, interpreter):
+        # Returns a string identifying the interpreter's runtime
+        return self.sandbox.get_runtime_version(interpreter)
+
+    def get_result_key(self, interpreter, code):
+        # Returns the result cache key for running code with interpreter
+        # Trailing whitespace and blank lines at either end don't change the key
+        normalized_code = '\n'.join(line.rstrip() for line in code.strip('\n').splitlines())
+        code_hash = hashlib.sha256(normalized_code.encode()).hexdigest()
+        return (interpreter, code_hash, self.get_runtime_version(interpreter))
+
+    def is_cacheable(self, code):
+        # Returns True if results of running code may be cached
+        return self.result_cache is not None and not RE_NOCACHE.search(code)
+
+    def get_shared_source(self, result):
+        # Returns where a result shared from an identical run came from:
+        # 'cache' if the run finished and was cached, otherwise 'shared',
+        # since halted runs aren't cached
+        if isinstance(result[2], int):
+            return 'cache'
+        return 'shared'
+
+    def run_code_cached(self, interpreter, code, progress=None):
+        # Execute code with run_code unless an identical run is cached or in progress
+        # Return STDOUT, STDERR, EXITCODE, USAGE and where the result came from:
+        # None if it was run for this request, 'cache' or 'shared' (see get_shared_source)
+        if not self.is_cacheable(code):
+            return self.run_code(interpreter, code, progress) + (None,)
+        key = self.get_result_key(interpreter, code)
+        result, flight, leader = self.result_cache.begin(key)
+        if result:
+            self.print_wrapper('Result cache hit')
+            self.metrics.increment('artoo_result_cache_total', result='hit')
+            return result + ('cache',)
+        if not leader:
+            # Share the identical run already in progress
+            self.print_wrapper('Waiting for identical run in progress')
+            self.metrics.increment('artoo_result_cache_total', result='shared')
+            try:
+                result = flight.result()
+            except Exception:
+                return self.run_code(interpreter, code, progress) + (None,)
+            return result + (self.get_shared_source(result),)
+        self.metrics.increment('artoo_result_cache_total', result='miss')
         try:
-            out, err = proc.communicate(timeout=self.PROC_TIMEOUT_SECS)
-            exitcode = proc.returncode
-        except TimeoutExpired:
-            proc.kill()
-            out, err = proc.communicate()
-            exitcode = 'Halted execution after {} seconds'.format(self.PROC_TIMEOUT_SECS)
-        return out.decode(), err.decode(), exitcode
-    
-    def write_to_temp(self, content):
-        # Write content to a NamedTemporaryFile and return the file handle
-        # Make the NamedTemporaryFile in the SELinux sandbox tmp directory
-        ftemp = NamedTemporaryFile(mode='w', delete=False, dir=self.sbox_tmp_dir)
-        ftemp.write(content)
-        ftemp.close()
-        return ftemp
-
-    def delete_temp(self, temp_handle):
-        # Delete the NamedTemporaryFile with handle temp_handle
-        self.print_wrapper('Deleting file: {}'.format(temp_handle.name))
-        os.remove(temp_handle.name)
-
-    def get_se_ftemp_path(self, ftemp_name):
-        return os.path.join(self.sbox_tmp, os.path.basename(ftemp_name))
-    
+            result = self.run_code(interpreter, code, progress)
+        except BaseException as err:
+            self.result_cache.finish(key, flight, error=err)
+            raise
+        # Don't cache runs which were halted
+        self.result_cache.finish(key, flight, result, store=isinstance(result[2], int))
+        return result + (None,)
+
+    async def async_run_code_cached(self, interpreter, code, progress=None):
+        # Event loop version of run_code_cached
+        if not self.is_cacheable(code):
+            return await self.async_run_code(interpreter, code, progress) + (None,)
+        key = self.get_result_key(interpreter, code)
+        result, flight, leader = self.result_cache.begin(key)
+        if result:
+            self.print_wrapper('Result cache hit')
+            self.metrics.increment('artoo_result_cache_total', result='hit')
+            return result + ('cache',)
+        if not leader:
+            self.print_wrapper('Waiting for identical run in progress')
+            self.metrics.increment('artoo_result_cache_total', result='shared')
+            try:
+                result = await asyncio.wrap_future(flight)
+            except Exception:
+                return await self.async_run_code(interpreter, code, progress) + (None,)
+            return result + (self.get_shared_source(result),)
+        self.metrics.increment('artoo_result_cache_total', result='miss')
+        try:
+            result = await self.async_run_code(interpreter, code, progress)
+        except BaseException as err:
+            self.result_cache.finish(key, flight, error=err)
+            raise
+        self.result_cache.finish(key, flight, result, store=isinstance(result[2], int))
+        return result + (None,)
+
     def run_bash(self, code):
-        # Execute code as bash code using a temporary file and a spawned process.
-        ftemp = self.write_to_temp(code)
-        self.print_wrapper('Executing bash code in temp file: {}'.format(ftemp.name))
-        ftemp_se_path = self.get_se_ftemp_path(ftemp.name)
-        out, err, exitcode = self.open_process(['bash', ftemp_se_path])
-        # Delete temporary file
-        self.delete_temp(ftemp)
-        return out, err, exitcode
+        # Execute code as bash code on the executor backend.
+        return self.run_code('bash', code)
 
     def run_python(self, code):
-        # Execute code as python code using a temporary file and a spawned process.
-        ftemp = self.write_to_temp(code)
-        self.print_wrapper('Executing python code in temp file: {}'.format(ftemp.name))
-        ftemp_se_path = self.get_se_ftemp_path(ftemp.name)
-        out, err, exitcode = self.open_process(['python', ftemp_se_path])
-        # Delete temporary file
-        self.delete_temp(ftemp)
-        return out, err, exitcode
+        # Execute code as python code on the executor backend.
+        return self.run_code('python', code)
 
     def ins_confused(self, tagged_message):
         # Help!
         reply = self.ins_only_hope(tagged_message)
         return reply
 
+    def ins_stats(self, tagged_message):
+        # Reply with a summary of the metrics
+        reply_user_tag = self.get_message_user_tag(tagged_message)
+        reply = "{} [Whistle, Bleep]\n```\n{}\n```".format(reply_user_tag, self.metrics.summary())
+        return reply
+
     def ins_only_hope(self, tagged_message):
         # Get the user reply tag
         reply_user_tag = self.get_message_user_tag(tagged_message)
         # Reply to user with a help string
-        reply = "{} [Electronic Trilling]\n--Please provide a command as--\n@artoo bash\n```\n[BASH CODE]\n```\n--or--\n@artoo python\n```\n[PYTHON 3 CODE]\n```\n--or--\nComment '@artoo python' or '@artoo bash' on a code snippet.".format(reply_user_tag)
+        reply = "{} [Electronic Trilling]\n--Please provide a command as--\n@artoo bash\n```\n[BASH CODE]\n```\n--or--\n@artoo python\n```\n[PYTHON 3 CODE]\n```\n--or--\nComment '@artoo python' or '@artoo bash' on a code snippet.\n--or--\n@artoo session python\n```\n[PYTHON 3 CODE]\n```\nto keep your variables for your next snippet, until\n@artoo session end\n--or--\n@artoo stats\nfor a summary of how long each step takes.".format(reply_user_tag)
         return reply
 
-    def ins_run_bash(self, tagged_message):
+    def prepare_run(self, tagged_message, interpreter):
+        # Gather what is needed to run the code in tagged_message with interpreter
+        # Returns a job dictionary, or None if there is no code to run
         # Get the reply user tag
         reply_user_tag = self.get_message_user_tag(tagged_message)
         
         # Get the message code
         message_code, file_url = self.get_message_code(tagged_message)
+        if message_code == '!ODD':
+            return {'interpreter': interpreter,
+                    'code': None,
+                    'file_url': file_url,
+                    'user_tag': reply_user_tag,
+                    'error': 'Your message has an odd number of ``` fences, so I can\'t tell where the code starts and ends.'}
+        if not message_code:
+            return None
 
-        # Run code with bash and formulate reply
-        if message_code:
-            self.print_wrapper('bash code:')
-            self.print_wrapper(message_code)
-            out, err, retcode = self.run_bash(message_code)
-            file_tag = ''
-            if file_url:
-                file_tag = 'File: {}\n'.format(file_url)
-            reply = "{} [Beep, Beep, Bleep!]\n{}stdout:\n{}\nstderr:\n{}\nreturn code: {}".format(reply_user_tag, file_tag, out, err, retcode)
+        self.print_wrapper('{} code:'.format(interpreter))
+        self.print_wrapper(message_code)
+        return {'interpreter': interpreter,
+                'code': message_code,
+                'file_url': file_url,
+                'user_tag': reply_user_tag,
+                'error': self.check_code(interpreter, message_code)}
+
+    def check_python_version(self):
+        # Returns True if the python on the sandbox PATH is the same version as
+        # the python running Artoo, so its syntax can be checked with compile()
+        if self.python_version_matches is None:
+            local_version = '{}.{}'.format(*sys.version_info[:2])
+            try:
+                proc = run(['python', '-c', 'import sys; print("{}.{}".format(*sys.version_info[:2]))'],
+                           stdout=PIPE, stderr=PIPE, env=self.sandbox.get_process_env(),
+                           timeout=self.SYNTAX_CHECK_TIMEOUT_SECS)
+                sandbox_version = proc.stdout.decode().strip()
+            except (OSError, TimeoutExpired):
+                sandbox_version = None
+            self.python_version_matches = sandbox_version == local_version
+            if not self.python_version_matches:
+                print('Sandbox python is version {}, not {}, so python syntax is not checked before running.'.format(
+                    sandbox_version, local_version))
+        return self.python_version_matches
+
+    def check_syntax(self, interpreter, code):
+        # Returns the syntax error in code for interpreter, '' if there isn't one
+        # or it can't be checked. Nothing in code is run.
+        if interpreter == 'python' and self.check_python_version():
+            try:
+                compile(code, '<snippet>', 'exec', dont_inherit=True)
+            except (SyntaxError, ValueError) as err:
+                return ''.join(traceback.format_exception_only(type(err), err)).rstrip()
+            except (RecursionError, MemoryError):
+                pass
+        elif interpreter == 'bash':
+            try:
+                proc = run(['bash', '-n'], input=code.encode(), stdout=PIPE, stderr=PIPE,
+                           env=self.sandbox.get_process_env(), timeout=self.SYNTAX_CHECK_TIMEOUT_SECS)
+            except (OSError, TimeoutExpired):
+                return ''
+            if proc.returncode != 0:
+                return proc.stderr.decode(errors='replace').rstrip()
+        return ''
+
+    def check_code(self, interpreter, code):
+        # Check code for interpreter before running it
+        # Returns why it can't run, or None if it may run
+        if not self.preflight:
+            return None
+        error = None
+        if not code.strip():
+            error = 'There is no code between the ``` fences.'
+        elif len(code.encode()) > self.MAX_CODE_BYTES:
+            error = 'Your code is {} bytes, more than the limit of {} bytes.'.format(len(code.encode()), self.MAX_CODE_BYTES)
+        else:
+            key = (interpreter, hashlib.sha256(code.encode()).hexdigest())
+            syntax_error = self.preflight_cache.get(key)
+            if syntax_error is None:
+                with self.metrics.timer('preflight'):
+                    syntax_error = self.check_syntax(interpreter, code)
+                self.preflight_cache.put(key, syntax_error)
+            if syntax_error:
+                error = 'Your {} code has a syntax error, so it wasn\'t run:\n```\n{}\n```'.format(interpreter, syntax_error)
+        self.metrics.increment('artoo_preflight_total', result='rejected' if error else 'ok')
+        return error
+
+    def format_error_reply(self, job):
+        # Formulate the reply for a job whose code can't run
+        file_tag = ''
+        if job['file_url']:
+            file_tag = 'File: {}\n'.format(job['file_url'])
+        return "{} [Disapproving Bleep]\n{}{}".format(job['user_tag'], file_tag, job['error'])
+
+    def format_run_reply(self, job, out, err, retcode, usage, source=None):
+        # Formulate the reply for a job that has been run
+        file_tag = ''
+        if job['file_url']:
+            file_tag = 'File: {}\n'.format(job['file_url'])
+        usage_tag = ''
+        if job.get('session'):
+            file_tag += '({})\n'.format(job['session'])
+        if source == 'cache':
+            file_tag += '(Served from cache)\n'
+        elif source == 'shared':
+            file_tag += '(Shared with an identical run in progress)\n'
+        elif usage:
+            usage_tag = '\nresources: {}'.format(self.format_usage(usage))
+        reply = "{} [Beep, Beep, Bleep!]\n{}stdout:\n{}\nstderr:\n{}\nreturn code: {}{}".format(job['user_tag'], file_tag, out, err, retcode, usage_tag)
+        return reply
+
+    def start_progress_reply(self, tagged_message, job):
+        # Returns a ProgressReply to show the job's output while it runs,
+        # None if output isn't streamed
+        if self.stream_output and 'channel' in tagged_message:
+            return ProgressReply(self, tagged_message['channel'], job['user_tag'], self.stream_interval)
+        return None
+
+    def ins_run_code(self, tagged_message, interpreter):
+        # Run the message code with interpreter and formulate reply
+        # Returns None if the reply was already posted while streaming output
+        job = self.prepare_run(tagged_message, interpreter)
+        if job and job['error']:
+            return self.format_error_reply(job)
+        elif job:
+            progress_reply = self.start_progress_reply(tagged_message, job)
+            progress = progress_reply.update if progress_reply else None
+            out, err, retcode, usage, source = self.run_code_cached(interpreter, job['code'], progress)
+            reply = self.format_run_reply(job, out, err, retcode, usage, source)
+            if progress_reply:
+                progress_reply.finish(reply)
+                return None
             return reply
         else:
             return self.ins_confused(tagged_message)
 
-    def ins_run_python(self, tagged_message):
-        # Get the reply user tag
-        reply_user_tag = self.get_message_user_tag(tagged_message)
-        
-        # Get the message code
-        message_code, file_url = self.get_message_code(tagged_message)
-
-        # Run code with python and formulate reply
-        if message_code:
-            self.print_wrapper('python code:')
-            self.print_wrapper(message_code)
-            out, err, retcode = self.run_python(message_code)
-            file_tag = ''
-            if file_url:
-                file_tag = 'File: {}\n'.format(file_url)
-            reply = "{} [Beep, Beep, Bleep!]\n{}stdout:\n{}\nstderr:\n{}\nreturn code: {}".format(reply_user_tag, file_tag, out, err, retcode)
+    async def async_ins_run_code(self, tagged_message, interpreter):
+        # Event loop version of ins_run_code
+        # Gathering the code may look up users and download files, so use the job pool
+        job = await self.run_blocking(self.prepare_run, tagged_message, interpreter)
+        if job and job['error']:
+            return self.format_error_reply(job)
+        elif job:
+            progress_reply = self.start_progress_reply(tagged_message, job)
+            progress = progress_reply.update if progress_reply else None
+            out, err, retcode, usage, source = await self.async_run_code_cached(interpreter, job['code'], progress)
+            reply = self.format_run_reply(job, out, err, retcode, usage, source)
+            if progress_reply:
+                await self.run_blocking(progress_reply.finish, reply)
+                return None
             return reply
         else:
+            return await self.run_blocking(self.ins_confused, tagged_message)
+
+    def ins_session(self, tagged_message):
+        # Run code in the user's persistent session in this channel, or end it
+        action = None
+        re_match = re.search(self.re_session, self.get_message_text(tagged_message))
+        if re_match:
+            action = re_match.group(1)
+        if self.session_pool is None or action not in ('python', 'end'):
+            return self.ins_confused(tagged_message)
+        key = (self.identity, tagged_message.get('user'), tagged_message.get('channel'))
+        if action == 'end':
+            reply_user_tag = self.get_message_user_tag(tagged_message)
+            if self.session_pool.end(key):
+                return "{} [Descending Whistle]\nSession ended.".format(reply_user_tag)
+            return "{} [Puzzled Bleep]\nYou don't have a session here.".format(reply_user_tag)
+
+        job = self.prepare_run(tagged_message, 'python')
+        if not job:
             return self.ins_confused(tagged_message)
+        if job['error']:
+            return self.format_error_reply(job)
+        session, started = self.session_pool.get(key)
+        if session is None:
+            return "{} [Worried Beeping]\nAll {} sessions are busy, please try again later.".format(
+                job['user_tag'], self.session_pool.max_sessions)
+        progress_reply = self.start_progress_reply(tagged_message, job)
+        progress = progress_reply.update if progress_reply else None
+        out, err, retcode, usage = session.run(job['code'], progress)
+        job['session'] = 'New session' if started else 'Session run {}'.format(session.num_runs)
+        if not isinstance(retcode, int):
+            job['session'] += ', session ended'
+        reply = self.format_run_reply(job, out, err, retcode, usage)
+        if progress_reply:
+            progress_reply.finish(reply)
+            return None
+        return reply
+
+    def ins_run_bash(self, tagged_message):
+        # Run code with bash and formulate reply
+        return self.ins_run_code(tagged_message, 'bash')
+
+    def ins_run_python(self, tagged_message):
+        # Run code with python and formulate reply
+        return self.ins_run_code(tagged_message, 'python')
+
+    async def async_ins_run_bash(self, tagged_message):
+        # Event loop version of ins_run_bash
+        return await self.async_ins_run_code(tagged_message, 'bash')
+
+    async def async_ins_run_python(self, tagged_message):
+        # Event loop version of ins_run_python
+        return await self.async_ins_run_code(tagged_message, 'python')
@@ -0,0 +1,155 @@
+"""
+Cache is a module containing the LRUCache, a thread-safe least recently
+used cache with optional time-to-live and size budget, and the
+ResultCache, an LRUCache which also lets concurrent requests for the
+same missing key share one computation (single-flight).
+
+Copyright (c) 2016 Donald E. Willcox
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import time
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+
+class LRUCache(object):
+    def __init__(self, max_entries=1024, max_bytes=None, ttl_secs=None, sizeof=None):
+        # Maximum number of entries, or None for no limit
+        self.max_entries = max_entries
+
+        # Maximum total size of the values, or None for no limit
+        self.max_bytes = max_bytes
+
+        # Seconds before an entry expires, or None to keep entries until evicted
+        self.ttl_secs = ttl_secs
+
+        # Function returning the size of a value, counted against max_bytes
+        if sizeof is None:
+            sizeof = len
+        self.sizeof = sizeof
+
+        # OrderedDict mapping keys to (value, expiry time, size),
+        # least recently used first
+        self.entries = OrderedDict()
+        self.num_bytes = 0
+        self.lock = threading.Lock()
+
+        # Counts of lookups which did and didn't find an entry
+        self.hits = 0
+        self.misses = 0
+
+    def get_locked(self, key):
+        # Returns the value for key, None if not present or expired
+        # The caller must hold self.lock
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        value, expiry, size = entry
+        if expiry is not None and time.time() > expiry:
+            self.remove_locked(key)
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put_locked(self, key, value):
+        # Add or replace the value for key, evicting entries to stay in budget
+        # The caller must hold self.lock
+        size = self.sizeof(value)
+        if self.max_bytes is not None and size > self.max_bytes:
+            # Never going to fit
+            return
+        self.remove_locked(key)
+        expiry = None
+        if self.ttl_secs is not None:
+            expiry = time.time() + self.ttl_secs
+        self.entries[key] = (value, expiry, size)
+        self.num_bytes += size
+        while ((self.max_entries is not None and len(self.entries) > self.max_entries) or
+               (self.max_bytes is not None and self.num_bytes > self.max_bytes)):
+            oldest_key = next(iter(self.entries))
+            self.remove_locked(oldest_key)
+
+    def remove_locked(self, key):
+        # Remove key if present
+        # The caller must hold self.lock
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.num_bytes -= entry[2]
+
+    def get(self, key):
+        # Returns the value for key, None if not present or expired
+        with self.lock:
+            return self.get_locked(key)
+
+    def put(self, key, value):
+        # Add or replace the value for key
+        with self.lock:
+            self.put_locked(key, value)
+
+    def remove(self, key):
+        # Remove key if present
+        with self.lock:
+            self.remove_locked(key)
+
+    def __len__(self):
+        with self.lock:
+            return len(self.entries)
+
+class ResultCache(LRUCache):
+    def __init__(self, max_entries=1024, max_bytes=None, ttl_secs=None, sizeof=None):
+        super(ResultCache, self).__init__(max_entries, max_bytes, ttl_secs, sizeof)
+
+        # Dict mapping keys being computed (keys) to the Future
+        # their result will be delivered on (values)
+        self.in_flight = {}
+
+    def begin(self, key):
+        # Start looking up key, returns (value, future, leader):
+        # - (value, None, False) if key is cached
+        # - (None, future, False) if key is being computed elsewhere,
+        #   future delivers the result when it is done
+        # - (None, future, True) if the caller should compute the result
+        #   and then call finish(key, future, ...)
+        with self.lock:
+            value = self.get_locked(key)
+            if value is not None:
+                return value, None, False
+            future = self.in_flight.get(key)
+            if future is not None:
+                return None, future, False
+            future = Future()
+            self.in_flight[key] = future
+            return None, future, True
+
+    def finish(self, key, future, value=None, error=None, store=True):
+        # Finish computing key: cache value if store is True, then
+        # deliver value (or raise error) to anyone waiting on future
+        with self.lock:
+            self.in_flight.pop(key, None)
+            if store and error is None and value is not None:
+                self.put_locked(key, value)
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(value)
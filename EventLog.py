@@ -0,0 +1,152 @@
+"""
+EventLog is a module containing the EventLog, which writes Slack
+messages as JSON Lines ({"t": time received, "message": message}) from a
+background thread, so logging doesn't hold up reading messages.
+
+Log files are rotated when they grow past max_bytes, keeping a number
+of older files which may be compressed with gzip. The format is the
+same as the traces read by artoo_bench.py and artoo_replay.py.
+
+Copyright (c) 2016 Donald E. Willcox
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import os
+import sys
+import gzip
+import json
+import time
+import shutil
+import threading
+from collections import deque
+
+class EventLog(object):
+    def __init__(self, path=None, max_bytes=64*1024*1024, backups=5, compress=False,
+                 flush_secs=1, max_pending=100000):
+        # File to write, or None for stdout (which is never rotated)
+        self.path = path
+
+        # Size at which the file is rotated, and number of older files kept
+        self.max_bytes = max_bytes
+        self.backups = backups
+
+        # Compress older files with gzip
+        self.compress = compress
+
+        # Seconds between writes, unless BATCH_SIZE messages are waiting
+        self.flush_secs = flush_secs
+        self.BATCH_SIZE = 1000
+
+        # Most messages waiting to be written, newer messages are dropped
+        self.max_pending = max_pending
+
+        # (time, message) tuples waiting to be written
+        self.pending = deque()
+        self.cond = threading.Condition()
+        self.closed = False
+
+        # Counts of messages written and dropped
+        self.num_written = 0
+        self.num_dropped = 0
+
+        self.stream = None
+        self.num_bytes = 0
+        self.open_stream()
+        self.writer = threading.Thread(target=self.write_loop, name='artoo-event-log', daemon=True)
+        self.writer.start()
+
+    def open_stream(self):
+        # Open the log file for appending (or use stdout)
+        if self.path is None:
+            self.stream = sys.stdout
+            return
+        self.stream = open(self.path, 'a', encoding='utf-8')
+        self.num_bytes = self.stream.tell()
+
+    def write(self, message):
+        # Queue message to be written, dropping it if too many are waiting
+        with self.cond:
+            if len(self.pending) >= self.max_pending:
+                self.num_dropped += 1
+                return
+            self.pending.append((time.time(), message))
+            if len(self.pending) >= self.BATCH_SIZE:
+                self.cond.notify()
+
+    def get_backup_path(self, index):
+        # Returns the path of the index-th older log file
+        return '{}.{}{}'.format(self.path, index, '.gz' if self.compress else '')
+
+    def rotate(self):
+        # Move the log file to the first backup, shifting older backups along
+        # and deleting the oldest, then start a new log file
+        self.stream.close()
+        if self.backups > 0:
+            for index in range(self.backups - 1, 0, -1):
+                if os.path.exists(self.get_backup_path(index)):
+                    os.replace(self.get_backup_path(index), self.get_backup_path(index + 1))
+            if self.compress:
+                with open(self.path, 'rb') as fsrc, gzip.open(self.get_backup_path(1), 'wb') as fdst:
+                    shutil.copyfileobj(fsrc, fdst)
+                os.remove(self.path)
+            else:
+                os.replace(self.path, self.get_backup_path(1))
+        else:
+            os.remove(self.path)
+        self.open_stream()
+
+    def write_records(self, records):
+        # Write (time, message) records to the log, rotating it if it's full
+        lines = ''.join(json.dumps({'t': t, 'message': message}, default=str) + '\n'
+                        for t, message in records)
+        self.stream.write(lines)
+        self.stream.flush()
+        self.num_written += len(records)
+        if self.path is not None:
+            self.num_bytes += len(lines.encode())
+            if self.num_bytes >= self.max_bytes:
+                self.rotate()
+
+    def write_loop(self):
+        # Write waiting messages every flush_secs (or every BATCH_SIZE messages) until closed
+        while True:
+            with self.cond:
+                self.cond.wait_for(lambda: self.closed or len(self.pending) >= self.BATCH_SIZE,
+                                   self.flush_secs)
+                records = self.pending
+                self.pending = deque()
+                closed = self.closed
+            if records:
+                try:
+                    self.write_records(records)
+                except (OSError, ValueError) as err:
+                    print('Could not write {} messages to the event log: {}'.format(len(records), err))
+                    self.num_dropped += len(records)
+            if closed:
+                return
+
+    def close(self):
+        # Write all waiting messages and close the log file
+        with self.cond:
+            self.closed = True
+            self.cond.notify()
+        self.writer.join()
+        if self.path is not None:
+            self.stream.close()
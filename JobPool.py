@@ -0,0 +1,88 @@
+"""
+JobPool is a module containing the JobPool, a fixed-size pool of
+worker threads on which a Slack bot runs the jobs requested of it.
+
+Running jobs on the pool lets the polling loop keep reading messages
+from Slack while several long-running jobs execute concurrently.
+
+Copyright (c) 2016 Donald E. Willcox
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+class JobPool(object):
+    def __init__(self, num_workers):
+        # Number of jobs which may execute at the same time
+        self.num_workers = max(1, int(num_workers))
+
+        # Worker threads
+        self.executor = ThreadPoolExecutor(max_workers=self.num_workers,
+                                           thread_name_prefix='artoo-job')
+
+        # Count of jobs submitted but not yet finished
+        self.lock = threading.Lock()
+        self.num_pending = 0
+
+    def job_done(self, future):
+        # Callback for finished jobs: update the pending count and
+        # report exceptions, which would otherwise be silently dropped
+        with self.lock:
+            self.num_pending -= 1
+        if future.cancelled():
+            return
+        exc = future.exception()
+        if exc:
+            print('Job raised an exception:')
+            traceback.print_exception(type(exc), exc, exc.__traceback__)
+
+    def submit(self, job, *args):
+        # Queue job(*args) to run on the next free worker, return its Future
+        with self.lock:
+            self.num_pending += 1
+        future = self.executor.submit(job, *args)
+        future.add_done_callback(self.job_done)
+        return future
+
+    def async_job_done(self, future):
+        # Callback for finished jobs submitted from an event loop
+        # Exceptions are left to the coroutine awaiting the job
+        with self.lock:
+            self.num_pending -= 1
+
+    def submit_async(self, loop, job, *args):
+        # Queue job(*args) to run on the next free worker, return an
+        # asyncio Future which the event loop in loop can await
+        with self.lock:
+            self.num_pending += 1
+        future = loop.run_in_executor(self.executor, job, *args)
+        future.add_done_callback(self.async_job_done)
+        return future
+
+    def pending(self):
+        # Returns the number of jobs queued or running
+        with self.lock:
+            return self.num_pending
+
+    def shutdown(self, wait=True):
+        # Stop accepting jobs and optionally wait for running jobs to finish
+        self.executor.shutdown(wait=wait)
@@ -0,0 +1,228 @@
+"""
+MessageQueue is a module containing the MessageQueue, which sends
+Web API calls that post to Slack channels from a dedicated thread.
+
+Each channel gets a token bucket so bursts of replies are paced to
+Slack's per-channel rate limits. Calls which are rate limited wait for
+the Retry-After time and are retried, calls which fail are retried with
+exponential backoff, and messages too long for one post are split into
+several. Calls to the same channel are sent in order.
+
+Copyright (c) 2016 Donald E. Willcox
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import time
+import threading
+import traceback
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+
+def get_retry_after(response, default=1):
+    # Returns the seconds to wait given by a rate limited Web API response
+    headers = response.get('headers', {})
+    retry_after = headers.get('Retry-After', headers.get('retry-after', default))
+    try:
+        return float(retry_after)
+    except (TypeError, ValueError):
+        return default
+
+class MessageQueue(object):
+    def __init__(self, slack_client, rate=1.0, burst=3, max_retries=5, max_chars=4000, max_depth=1000,
+                 metrics=None):
+        # Client used for Web API calls
+        self.slack_client = slack_client
+
+        # Metrics to record calls in, or None
+        self.metrics = metrics
+
+        # Calls per second allowed for each channel, and how many may be sent at once
+        self.rate = rate
+        self.burst = burst
+
+        # Times a failed call is retried before it is dropped
+        self.max_retries = max_retries
+
+        # Longest message text posted as one message
+        self.max_chars = max_chars
+
+        # Most calls that may be waiting to be sent
+        self.max_depth = max_depth
+
+        # OrderedDict mapping channels (keys) to deques of calls waiting to be sent (values)
+        # Each call is a dictionary with the method, its arguments, a Future for
+        # the response, the number of attempts and the earliest time to try again
+        self.channels = OrderedDict()
+
+        # Dict mapping channels (keys) to [tokens, time of last refill] (values)
+        self.buckets = {}
+
+        # Counts of calls sent successfully, retried, and dropped
+        self.depth = 0
+        self.sent = 0
+        self.retried = 0
+        self.dropped = 0
+
+        self.condition = threading.Condition()
+        self.sender_thread = threading.Thread(target=self.send_loop, name='artoo-sender', daemon=True)
+        self.sender_thread.start()
+
+    def split_text(self, text):
+        # Split text into parts of at most max_chars characters, on line breaks if possible
+        parts = []
+        while len(text) > self.max_chars:
+            split_at = text.rfind('\n', 0, self.max_chars)
+            if split_at <= 0:
+                split_at = self.max_chars
+            parts.append(text[:split_at])
+            text = text[split_at:].lstrip('\n')
+        parts.append(text)
+        return parts
+
+    def send(self, method, channel, **kwargs):
+        # Queue a Web API call to channel, return a Future for its response
+        # A queued chat.update to the same message is replaced rather than sent twice
+        future = Future()
+        with self.condition:
+            calls = self.channels.setdefault(channel, deque())
+            if method == 'chat.update':
+                for call in calls:
+                    if (call['method'] == method and call['attempts'] == 0 and
+                            call['kwargs'].get('ts') == kwargs.get('ts')):
+                        call['kwargs'] = kwargs
+                        return call['future']
+            if self.depth >= self.max_depth:
+                self.count('dropped')
+                print('Outgoing message queue is full, dropping {} to {}'.format(method, channel))
+                future.set_result({'ok': False, 'error': 'queue_full'})
+                return future
+            calls.append({'method': method, 'kwargs': kwargs, 'future': future,
+                          'attempts': 0, 'not_before': 0})
+            self.depth += 1
+            self.condition.notify()
+        return future
+
+    def post_message(self, channel, text, **kwargs):
+        # Queue text to be posted to channel, split into several messages if it's too long
+        # Return a Future for the response to posting the first message
+        parts = self.split_text(text)
+        first_future = self.send('chat.postMessage', channel, text=parts[0], **kwargs)
+        for part in parts[1:]:
+            self.send('chat.postMessage', channel, text=part, **kwargs)
+        return first_future
+
+    def take_token(self, channel, now):
+        # Returns 0 and uses a token if channel may be sent a call now,
+        # otherwise returns the seconds until it may
+        tokens, last_refill = self.buckets.get(channel, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - last_refill)*self.rate)
+        if tokens >= 1:
+            self.buckets[channel] = (tokens - 1, now)
+            return 0
+        self.buckets[channel] = (tokens, now)
+        return (1 - tokens)/self.rate
+
+    def next_call(self):
+        # Wait for a call which may be sent now, remove it from its queue and return it
+        with self.condition:
+            while True:
+                now = time.time()
+                wait_secs = None
+                for channel, calls in self.channels.items():
+                    if not calls:
+                        continue
+                    call = calls[0]
+                    channel_wait = call['not_before'] - now
+                    if channel_wait <= 0:
+                        channel_wait = self.take_token(channel, now)
+                    if channel_wait <= 0:
+                        calls.popleft()
+                        self.depth -= 1
+                        # Serve the other channels first next time
+                        self.channels.move_to_end(channel)
+                        return channel, call
+                    if wait_secs is None or channel_wait < wait_secs:
+                        wait_secs = channel_wait
+                # Forget idle channels, and their buckets once they have refilled
+                for channel in [c for c, calls in self.channels.items() if not calls]:
+                    del self.channels[channel]
+                for channel in [c for c in self.buckets if c not in self.channels]:
+                    tokens, last_refill = self.buckets[channel]
+                    if tokens + (now - last_refill)*self.rate >= self.burst:
+                        del self.buckets[channel]
+                self.condition.wait(wait_secs)
+
+    def retry_call(self, channel, call, delay):
+        # Put call back at the front of its channel's queue to be sent after delay seconds
+        with self.condition:
+            call['not_before'] = time.time() + delay
+            self.channels.setdefault(channel, deque()).appendleft(call)
+            self.depth += 1
+            self.count('retried')
+            self.condition.notify()
+
+    def send_call(self, channel, call):
+        # Make a Web API call, retrying if it is rate limited or fails
+        call['attempts'] += 1
+        start_time = time.time()
+        try:
+            response = self.slack_client.api_call(call['method'], channel=channel, **call['kwargs'])
+        except Exception as err:
+            response = {'ok': False, 'error': str(err)}
+            retryable = True
+            delay = 2**(call['attempts'] - 1)
+        else:
+            retryable = response.get('error') == 'ratelimited'
+            delay = get_retry_after(response)
+        if self.metrics:
+            self.metrics.observe('artoo_stage_seconds', time.time() - start_time, stage='post')
+        if response.get('ok'):
+            with self.condition:
+                self.count('sent')
+            call['future'].set_result(response)
+        elif retryable and call['attempts'] <= self.max_retries:
+            self.retry_call(channel, call, delay)
+        else:
+            with self.condition:
+                self.count('dropped')
+            print('Could not send {} to {}: {}'.format(call['method'], channel, response.get('error')))
+            call['future'].set_result(response)
+
+    def count(self, result):
+        # Count a call as sent, retried or dropped
+        # The caller must hold self.condition
+        setattr(self, result, getattr(self, result) + 1)
+        if self.metrics:
+            self.metrics.increment('artoo_messages_total', result=result)
+
+    def send_loop(self):
+        # Send calls as they become ready, forever
+        while True:
+            channel, call = self.next_call()
+            try:
+                self.send_call(channel, call)
+            except Exception:
+                traceback.print_exc()
+
+    def stats(self):
+        # Returns a dictionary of the queue depth and counts of sent, retried and dropped calls
+        with self.condition:
+            return {'depth': self.depth, 'sent': self.sent,
+                    'retried': self.retried, 'dropped': self.dropped}
@@ -0,0 +1,206 @@
+"""
+Metrics is a module containing Metrics, a thread-safe registry of
+counters, gauges and latency histograms, which can be rendered in the
+Prometheus text format and served over HTTP on localhost.
+
+Copyright (c) 2016 Donald E. Willcox
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import time
+import threading
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Upper bounds in seconds of the latency histogram buckets
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+class Histogram(object):
+    def __init__(self, buckets):
+        # Upper bounds of the buckets, and the number of observations in each
+        self.buckets = buckets
+        self.counts = [0]*(len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        # Add one observation
+        index = len(self.buckets)
+        for i, upper_bound in enumerate(self.buckets):
+            if value <= upper_bound:
+                index = i
+                break
+        self.counts[index] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, fraction):
+        # Returns the upper bound of the bucket holding the given quantile,
+        # infinity if it's beyond the last bucket
+        target = fraction*self.count
+        cumulative = 0
+        for i, count in enumerate(self.counts):
+            cumulative += count
+            if cumulative >= target and cumulative > 0:
+                if i < len(self.buckets):
+                    return self.buckets[i]
+                break
+        return float('inf')
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    # Serves the metrics at /metrics
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = self.server.metrics.render().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+class Metrics(object):
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        # Histogram bucket upper bounds in seconds
+        self.buckets = buckets
+
+        # Dicts mapping (name, labels) (keys) to Histograms or counts (values)
+        # where labels is a sorted tuple of (label, value) pairs
+        self.histograms = {}
+        self.counters = {}
+
+        # Dict mapping gauge names (keys) to functions returning their value (values)
+        self.gauges = {}
+
+        # Dict mapping metric names (keys) to help strings (values)
+        self.help = {}
+
+        self.lock = threading.Lock()
+        self.http_server = None
+
+    def describe(self, name, help_text):
+        # Set the help string of a metric
+        self.help[name] = help_text
+
+    def observe(self, name, value, **labels):
+        # Add value to the histogram name with labels
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            if key not in self.histograms:
+                self.histograms[key] = Histogram(self.buckets)
+            self.histograms[key].observe(value)
+
+    def increment(self, name, amount=1, **labels):
+        # Add amount to the counter name with labels
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def register_gauge(self, name, function, help_text=None):
+        # Report the value returned by function as the gauge name
+        self.gauges[name] = function
+        if help_text:
+            self.describe(name, help_text)
+
+    @contextmanager
+    def timer(self, stage, **labels):
+        # Time the enclosed block as stage in the artoo_stage_seconds histogram,
+        # counting it in artoo_stage_errors_total if it raises an exception
+        start_time = time.time()
+        try:
+            yield
+        except BaseException:
+            self.increment('artoo_stage_errors_total', stage=stage, **labels)
+            raise
+        finally:
+            self.observe('artoo_stage_seconds', time.time() - start_time, stage=stage, **labels)
+
+    def format_labels(self, labels, extra=()):
+        # Returns labels in the Prometheus text format
+        pairs = list(labels) + list(extra)
+        if not pairs:
+            return ''
+        return '{' + ','.join('{}="{}"'.format(label, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                              for label, value in pairs) + '}'
+
+    def render(self):
+        # Returns all the metrics in the Prometheus text format
+        lines = []
+        with self.lock:
+            histograms = sorted(self.histograms.items())
+            counters = sorted(self.counters.items())
+        described = set()
+        def describe_once(name, metric_type):
+            if name not in described:
+                described.add(name)
+                if name in self.help:
+                    lines.append('# HELP {} {}'.format(name, self.help[name]))
+                lines.append('# TYPE {} {}'.format(name, metric_type))
+        for (name, labels), count in counters:
+            describe_once(name, 'counter')
+            lines.append('{}{} {}'.format(name, self.format_labels(labels), count))
+        for name in sorted(self.gauges):
+            try:
+                value = self.gauges[name]()
+            except Exception:
+                continue
+            describe_once(name, 'gauge')
+            lines.append('{} {}'.format(name, value))
+        for (name, labels), histogram in histograms:
+            describe_once(name, 'histogram')
+            cumulative = 0
+            for upper_bound, count in zip(list(histogram.buckets) + ['+Inf'], histogram.counts):
+                cumulative += count
+                lines.append('{}_bucket{} {}'.format(name, self.format_labels(labels, [('le', upper_bound)]), cumulative))
+            lines.append('{}_sum{} {}'.format(name, self.format_labels(labels), histogram.sum))
+            lines.append('{}_count{} {}'.format(name, self.format_labels(labels), histogram.count))
+        return '\n'.join(lines) + '\n'
+
+    def summary(self):
+        # Returns a short human readable summary of the metrics
+        lines = []
+        with self.lock:
+            histograms = sorted(self.histograms.items())
+            counters = sorted(self.counters.items())
+        for (name, labels), histogram in histograms:
+            lines.append('{}{} n={} mean={:.3f}s p50<={}s p95<={}s'.format(
+                name, self.format_labels(labels), histogram.count,
+                histogram.sum/max(1, histogram.count),
+                histogram.quantile(0.5), histogram.quantile(0.95)))
+        for (name, labels), count in counters:
+            lines.append('{}{} {}'.format(name, self.format_labels(labels), count))
+        for name in sorted(self.gauges):
+            try:
+                lines.append('{} {}'.format(name, self.gauges[name]()))
+            except Exception:
+                continue
+        return '\n'.join(lines)
+
+    def start_http_server(self, port, address='127.0.0.1'):
+        # Serve the metrics at http://[address]:[port]/metrics from a background thread
+        self.http_server = ThreadingHTTPServer((address, port), MetricsHandler)
+        self.http_server.daemon_threads = True
+        self.http_server.metrics = self
+        threading.Thread(target=self.http_server.serve_forever,
+                         name='artoo-metrics', daemon=True).start()
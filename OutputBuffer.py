@@ -0,0 +1,89 @@
+"""
+OutputBuffer is a module containing the OutputBuffer, which collects
+the output of a process as it is read while keeping memory bounded.
+
+Up to half the limit is kept from the start of the output and up to
+half from the end; anything in between is counted but discarded.
+
+Copyright (c) 2016 Donald E. Willcox
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import os
+import threading
+
+class OutputBuffer(object):
+    def __init__(self, max_bytes):
+        # Bytes kept from the start and the end of the output
+        self.head_limit = max_bytes // 2
+        self.tail_limit = max_bytes - self.head_limit
+
+        self.head = bytearray()
+        self.tail = bytearray()
+
+        # Total number of bytes written, including discarded ones
+        self.num_bytes = 0
+        self.lock = threading.Lock()
+
+    def write(self, data):
+        # Add data to the end of the output
+        with self.lock:
+            self.num_bytes += len(data)
+            head_room = self.head_limit - len(self.head)
+            if head_room > 0:
+                self.head += data[:head_room]
+                data = data[head_room:]
+            self.tail += data
+            if len(self.tail) > self.tail_limit:
+                del self.tail[:len(self.tail) - self.tail_limit]
+
+    def read_from(self, pipe, chunk_size=65536):
+        # Read pipe until it is closed, adding everything read to the output
+        fd = pipe.fileno()
+        while True:
+            data = os.read(fd, chunk_size)
+            if not data:
+                break
+            self.write(data)
+        pipe.close()
+
+    def num_omitted(self):
+        # Returns the number of bytes discarded from the middle of the output
+        return self.num_bytes - len(self.head) - len(self.tail)
+
+    def getvalue(self):
+        # Returns the output decoded as text, marking where bytes were discarded
+        with self.lock:
+            omitted = self.num_omitted()
+            if omitted:
+                return '{}\n... [{} bytes omitted] ...\n{}'.format(
+                    self.head.decode(errors='replace'), omitted,
+                    self.tail.decode(errors='replace'))
+            return (self.head + self.tail).decode(errors='replace')
+
+    def get_tail(self, max_chars):
+        # Returns up to the last max_chars characters of output decoded as text
+        with self.lock:
+            if self.num_omitted():
+                data = self.tail
+            else:
+                data = self.head + self.tail
+            # A character is at most 4 bytes in UTF-8
+            return data[-4*max_chars:].decode(errors='replace')[-max_chars:]
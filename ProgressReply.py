@@ -0,0 +1,123 @@
+"""
+ProgressReply is a module containing the ProgressReply, a Slack reply
+which shows the output of a job while it is still running.
+
+The reply is posted once the job has run for a little while, then
+edited with chat.update as more output arrives (at most once per
+interval), and finally replaced with the complete reply.
+
+Copyright (c) 2016 Donald E. Willcox
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import time
+import threading
+
+class ProgressReply(object):
+    def __init__(self, slack_bot, channel, header, interval=3, tail_chars=1500):
+        # SlackBotInterface used to post and update the reply
+        self.slack_bot = slack_bot
+
+        # Channel to reply in
+        self.channel = channel
+
+        # Text at the start of every version of the reply
+        self.header = header
+
+        # Minimum seconds between updates
+        self.interval = interval
+
+        # Characters from the end of stdout and stderr to show while running
+        self.tail_chars = tail_chars
+
+        # Timestamp identifying the posted reply, None until posted
+        self.ts = None
+
+        # Future for the response to posting the reply, None if no post is waiting
+        self.posting = None
+
+        # Set once the final reply is given, after which updates are ignored
+        # If it comes while the first post is waiting, it is kept in final_text
+        self.finished = False
+        self.final_text = None
+
+        self.start_time = time.time()
+        self.last_update = self.start_time
+        # Reentrant, since a post may already be done when its callback is added
+        self.lock = threading.RLock()
+
+    def format_progress(self, out_buf, err_buf):
+        # Formulate the reply for a job that is still running
+        elapsed = time.time() - self.start_time
+        return "{} [Running for {:.0f} seconds...]\nstdout:\n{}\nstderr:\n{}".format(
+            self.header, elapsed, out_buf.get_tail(self.tail_chars), err_buf.get_tail(self.tail_chars))
+
+    def update(self, out_buf, err_buf):
+        # Show the latest output, if at least self.interval seconds have passed
+        with self.lock:
+            now = time.time()
+            if self.finished or now - self.last_update < self.interval:
+                return
+            self.last_update = now
+            text = self.format_progress(out_buf, err_buf)
+            if self.ts is not None:
+                self.update_message(text)
+            elif self.posting is None:
+                # Don't wait for the post here, which would hold up the job's
+                # limit checks while the message queue paces or retries
+                self.posting = self.slack_bot.post_reply(self.channel, text)
+                self.posting.add_done_callback(self.posted)
+
+    def posted(self, future):
+        # Record which message later updates edit, once the first post is answered
+        with self.lock:
+            self.posting = None
+            response = future.result()
+            if response.get('ok'):
+                self.ts = response.get('ts')
+                self.channel = response.get('channel', self.channel)
+            if self.finished:
+                self.show_final(self.final_text)
+
+    def update_message(self, text):
+        # Queue an edit of the posted reply to show text
+        self.slack_bot.message_queue.send("chat.update", self.channel, ts=self.ts, text=text, as_user=True)
+
+    def finish(self, text):
+        # Replace the running reply with text, or post text if nothing was posted yet
+        with self.lock:
+            self.finished = True
+            if self.posting is not None:
+                # Shown once the first post is answered
+                self.final_text = text
+            else:
+                self.show_final(text)
+
+    def show_final(self, text):
+        # Edit the posted reply to show text, or post text if nothing was posted
+        if self.ts is None:
+            self.slack_bot.post_reply(self.channel, text)
+        else:
+            # Edit the message with as much as fits and post the rest
+            message_queue = self.slack_bot.message_queue
+            parts = message_queue.split_text(text)
+            self.update_message(parts[0])
+            for part in parts[1:]:
+                self.slack_bot.post_reply(self.channel, part)
@@ -0,0 +1,362 @@
+"""
+RemoteExecutor is a module containing the RemoteExecutor, which hands
+jobs to executor workers on this or other hosts, and the ExecutorWorker,
+which connects to a RemoteExecutor and runs its jobs in a Sandbox.
+
+Workers connect to the RemoteExecutor over TCP and prove they know the
+shared secret, then receive one job at a time as newline-delimited
+JSON, replying with progress messages while it runs and its result.
+Each connection runs one job at a time, so work spreads over the
+workers as they become free.
+
+Copyright (c) 2016 Donald E. Willcox
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import hmac
+import json
+import time
+import queue
+import select
+import socket
+import asyncio
+import threading
+from OutputBuffer import OutputBuffer
+
+# Largest message a worker or the RemoteExecutor will read, in bytes
+MAX_MESSAGE_BYTES = 4*1024*1024
+
+def parse_address(address):
+    # Returns the (host, port) tuple for an address given as HOST:PORT
+    host, sep, port = address.rpartition(':')
+    if not sep:
+        raise ValueError('Expected an address as HOST:PORT, not {}'.format(address))
+    return host or '0.0.0.0', int(port)
+
+def read_secret(secret_file):
+    # Returns the shared secret stored in secret_file
+    with open(secret_file) as fsecret:
+        secret = fsecret.read().strip()
+    if not secret:
+        raise ValueError('Executor secret file {} is empty'.format(secret_file))
+    return secret
+
+def send_message(sock, message):
+    # Send the dictionary message over sock as one line of JSON
+    sock.sendall(json.dumps(message).encode() + b'\n')
+
+def read_message(reader):
+    # Read one line of JSON from the file reader and return it as a
+    # dictionary, or None if the connection has closed
+    line = reader.readline(MAX_MESSAGE_BYTES)
+    if not line:
+        return None
+    if not line.endswith(b'\n'):
+        raise ValueError('Message longer than {} bytes'.format(MAX_MESSAGE_BYTES))
+    return json.loads(line.decode())
+
+class RemoteExecutor(object):
+    def __init__(self, address, secret, job_pool, metrics, verbose=False,
+                 proc_timeout=300, queue_timeout=300, max_attempts=2):
+        # Address (HOST:PORT) to listen on for workers
+        self.address = parse_address(address)
+
+        # Secret which workers must send before they are given jobs
+        self.secret = secret
+
+        # Job pool used to wait for remote jobs from the event loop
+        self.job_pool = job_pool
+
+        self.metrics = metrics
+        self.verbose = verbose
+
+        # Seconds a job may run on a worker, plus time for its reply to arrive
+        self.proc_timeout = proc_timeout
+        self.REPLY_GRACE_SECS = 60
+
+        # Seconds a job may wait for a free worker
+        self.queue_timeout = queue_timeout
+
+        # Number of workers to try a job on, if workers are lost while running it
+        self.max_attempts = max_attempts
+
+        # Seconds a new connection has to send its hello
+        self.HELLO_TIMEOUT_SECS = 10
+
+        # Seconds between checks that idle workers are still connected
+        self.IDLE_CHECK_SECS = 1
+
+        # Jobs waiting for a worker
+        self.jobs = queue.Queue()
+        self.next_job_id = 0
+        self.lock = threading.Lock()
+        self.num_workers = 0
+
+        self.metrics.describe('artoo_executor_jobs_total', 'Jobs sent to executor workers by outcome.')
+        self.metrics.register_gauge('artoo_executor_workers', lambda: self.num_workers,
+                                    'Executor workers connected.')
+        self.metrics.register_gauge('artoo_executor_queue_depth', lambda: self.jobs.qsize(),
+                                    'Jobs waiting for an executor worker.')
+
+        self.listener = socket.create_server(self.address)
+        self.address = self.listener.getsockname()[:2]
+        threading.Thread(target=self.accept_loop, daemon=True).start()
+        print('Waiting for executor workers on {}:{}'.format(self.address[0], self.address[1]))
+
+    def print_wrapper(self, to_print):
+        # Wrapper for python print that checks verbosity status
+        if self.verbose:
+            print(to_print)
+
+    def accept_loop(self):
+        # Accept worker connections, serving each on its own thread
+        while True:
+            try:
+                conn, peer = self.listener.accept()
+            except OSError:
+                return
+            threading.Thread(target=self.serve_worker, args=(conn, peer), daemon=True).start()
+
+    def serve_worker(self, conn, peer):
+        # Check the worker's secret, then send it jobs until it disconnects
+        reader = conn.makefile('rb')
+        try:
+            conn.settimeout(self.HELLO_TIMEOUT_SECS)
+            hello = read_message(reader)
+            # Compare as bytes, since compare_digest rejects non-ASCII strings
+            if (not isinstance(hello, dict) or hello.get('type') != 'hello' or
+                not hmac.compare_digest(str(hello.get('secret', '')).encode(), self.secret.encode())):
+                print('Rejected executor worker at {}:{}'.format(peer[0], peer[1]))
+                return
+            conn.settimeout(None)
+            # Let the kernel notice workers whose hosts vanish without closing the connection
+            conn.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+            with self.lock:
+                self.num_workers += 1
+            print('Executor worker {} connected from {}:{}'.format(hello.get('name'), peer[0], peer[1]))
+            try:
+                while self.serve_job(conn, reader, hello.get('name')):
+                    pass
+            finally:
+                with self.lock:
+                    self.num_workers -= 1
+                print('Executor worker {} disconnected'.format(hello.get('name')))
+        except (OSError, ValueError) as err:
+            print('Executor worker at {}:{} failed: {}'.format(peer[0], peer[1], err))
+        finally:
+            reader.close()
+            conn.close()
+
+    def connection_alive(self, conn):
+        # Returns False if an idle worker's connection has been closed or reset
+        # Workers send nothing between jobs, so a readable socket means it has
+        try:
+            readable = select.select([conn], [], [], 0)[0]
+            return not readable or bool(conn.recv(1, socket.MSG_PEEK))
+        except OSError:
+            return False
+
+    def serve_job(self, conn, reader, worker_name):
+        # Send the next waiting job to a worker and pass on its replies
+        # Returns False if the connection has been lost
+        job = None
+        while job is None:
+            try:
+                job = self.jobs.get(timeout=self.IDLE_CHECK_SECS)
+            except queue.Empty:
+                if not self.connection_alive(conn):
+                    return False
+        if job['abandoned']:
+            return True
+        # A worker lost while idle gives the job back without using up an attempt
+        if not self.connection_alive(conn):
+            self.jobs.put(job)
+            return False
+        self.print_wrapper('Sending job {} to executor worker {}'.format(job['id'], worker_name))
+        try:
+            send_message(conn, {'type': 'job', 'id': job['id'],
+                                'interpreter': job['interpreter'],
+                                'code': job['code'],
+                                'progress': job['progress']})
+        except OSError:
+            self.jobs.put(job)
+            raise
+        job['attempts'] += 1
+        job['events'].put(('start', None))
+        try:
+            while True:
+                message = read_message(reader)
+                if message is None:
+                    raise OSError('connection closed')
+                if message.get('id') != job['id']:
+                    continue
+                if message.get('type') == 'progress':
+                    job['events'].put(('progress', message))
+                elif message.get('type') == 'result':
+                    job['events'].put(('result', message))
+                    return True
+        except (OSError, ValueError):
+            # Try the job on another worker, or give up on it
+            if job['attempts'] < self.max_attempts and not job['abandoned']:
+                self.jobs.put(job)
+            else:
+                job['events'].put(('lost', None))
+            raise
+
+    def make_buffer(self, text):
+        # Returns an OutputBuffer holding text, for progress functions
+        data = text.encode()
+        buf = OutputBuffer(max(1, len(data)))
+        buf.write(data)
+        return buf
+
+    def run_code(self, interpreter, code, progress=None):
+        # Queue code to run with interpreter on the next free worker and wait
+        # for it, calling progress(out_buf, err_buf) as the worker reports output.
+        # Return STDOUT, STDERR, EXITCODE, and resource USAGE
+        with self.lock:
+            self.next_job_id += 1
+            job = {'id': self.next_job_id, 'interpreter': interpreter, 'code': code,
+                   'progress': progress is not None, 'attempts': 0,
+                   'abandoned': False, 'events': queue.Queue()}
+        start_time = time.time()
+        deadline = start_time + self.queue_timeout
+        self.jobs.put(job)
+        while True:
+            try:
+                event, message = job['events'].get(timeout=max(0, deadline - time.time()))
+            except queue.Empty:
+                job['abandoned'] = True
+                if job['attempts']:
+                    exitcode = 'Halted execution after no reply from the executor for {} seconds'.format(
+                        self.proc_timeout + self.REPLY_GRACE_SECS)
+                    outcome = 'timeout'
+                else:
+                    exitcode = 'No executor was free for {} seconds'.format(self.queue_timeout)
+                    outcome = 'unavailable'
+                break
+            if event == 'start':
+                deadline = time.time() + self.proc_timeout + self.REPLY_GRACE_SECS
+            elif event == 'progress':
+                progress(self.make_buffer(message.get('out', '')), self.make_buffer(message.get('err', '')))
+            elif event == 'result':
+                self.metrics.increment('artoo_executor_jobs_total', result='ok')
+                return message['out'], message['err'], message['exitcode'], message['usage']
+            elif event == 'lost':
+                exitcode = 'Lost the executor while running the job'
+                outcome = 'lost'
+                break
+        self.metrics.increment('artoo_executor_jobs_total', result=outcome)
+        return '', '', exitcode, {'wall_secs': time.time() - start_time}
+
+    async def async_run_code(self, interpreter, code, progress=None):
+        # Event loop version of run_code, waiting for the job on the job pool
+        return await self.job_pool.submit_async(asyncio.get_event_loop(), self.run_code,
+                                                interpreter, code, progress)
+
+class ExecutorWorker(object):
+    def __init__(self, sandbox, address, secret, num_jobs=1, name=None, verbose=False):
+        # Sandbox which runs the jobs
+        self.sandbox = sandbox
+
+        # Address (HOST:PORT) of the RemoteExecutor
+        self.address = parse_address(address)
+
+        # Secret shared with the RemoteExecutor
+        self.secret = secret
+
+        # Number of jobs to run at the same time, one per connection
+        self.num_jobs = max(1, int(num_jobs))
+
+        # Name reported to the RemoteExecutor
+        self.name = name or socket.gethostname()
+
+        self.verbose = verbose
+
+        # Characters of output sent in each progress message
+        self.PROGRESS_TAIL_CHARS = 1500
+
+        # Longest wait in seconds before reconnecting
+        self.MAX_RECONNECT_SECS = 30
+
+    def print_wrapper(self, to_print):
+        # Wrapper for python print that checks verbosity status
+        if self.verbose:
+            print(to_print)
+
+    def run_job(self, conn, job):
+        # Run one job in the sandbox and send back its result
+        progress = None
+        if job.get('progress'):
+            def progress(out_buf, err_buf):
+                send_message(conn, {'type': 'progress', 'id': job['id'],
+                                    'out': out_buf.get_tail(self.PROGRESS_TAIL_CHARS),
+                                    'err': err_buf.get_tail(self.PROGRESS_TAIL_CHARS)})
+        self.print_wrapper('Running job {} with {}'.format(job['id'], job['interpreter']))
+        out, err, exitcode, usage = self.sandbox.run_code(job['interpreter'], job['code'], progress)
+        send_message(conn, {'type': 'result', 'id': job['id'], 'out': out, 'err': err,
+                            'exitcode': exitcode, 'usage': usage})
+
+    def serve_connection(self, conn):
+        # Introduce this worker to the RemoteExecutor and run the jobs it sends
+        reader = conn.makefile('rb')
+        try:
+            send_message(conn, {'type': 'hello', 'secret': self.secret, 'name': self.name})
+            while True:
+                job = read_message(reader)
+                if job is None:
+                    return
+                if job.get('type') == 'job':
+                    self.run_job(conn, job)
+        finally:
+            reader.close()
+
+    def connection_loop(self):
+        # Keep a connection to the RemoteExecutor open, reconnecting with
+        # exponential backoff whenever it is lost
+        wait_secs = 1
+        while True:
+            try:
+                conn = socket.create_connection(self.address)
+            except OSError as err:
+                self.print_wrapper('Could not connect to {}:{}: {}'.format(self.address[0], self.address[1], err))
+            else:
+                print('Connected to Artoo at {}:{}'.format(self.address[0], self.address[1]))
+                wait_secs = 1
+                try:
+                    self.serve_connection(conn)
+                except (OSError, ValueError) as err:
+                    print('Connection to Artoo failed: {}'.format(err))
+                finally:
+                    conn.close()
+            time.sleep(wait_secs)
+            wait_secs = min(2*wait_secs, self.MAX_RECONNECT_SECS)
+
+    def run(self):
+        # Run num_jobs connections to the RemoteExecutor until interrupted
+        threads = [threading.Thread(target=self.connection_loop, daemon=True)
+                   for i in range(self.num_jobs)]
+        for thread in threads:
+            thread.start()
+        try:
+            for thread in threads:
+                thread.join()
+        except KeyboardInterrupt:
+            print('Executor worker stopped')
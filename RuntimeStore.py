@@ -0,0 +1,283 @@
+"""
+RuntimeStore is a module containing the RuntimeStore, which keeps the
+files of sandbox runtimes (such as python distributions) in a content
+addressed store and builds read-only runtimes from them with hard links.
+
+Each file is stored once, named by the SHA-256 of its content (and
+whether it is executable), however many runtimes use it. A runtime is
+described by a manifest of its directories, files and symbolic links,
+and installing it only makes directories and links, so it takes seconds.
+Stored files and installed runtimes are not writable, and symbolic links
+may only point inside their runtime.
+
+Copyright (c) 2016 Donald E. Willcox
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import os
+import json
+import shutil
+import stat
+import hashlib
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+class RuntimeStore(object):
+    def __init__(self, store_dir='runtime_store', runtimes_dir=os.path.join('sbox_home', 'runtimes'),
+                 num_workers=8, verbose=False):
+        # Directory holding the stored files (objects) and runtime manifests
+        self.store_dir = os.path.abspath(store_dir)
+        self.objects_dir = os.path.join(self.store_dir, 'objects')
+        self.manifests_dir = os.path.join(self.store_dir, 'manifests')
+
+        # Directory where runtimes are installed, on the same filesystem as
+        # the store so that files can be hard linked
+        self.runtimes_dir = os.path.abspath(runtimes_dir)
+
+        # Threads hashing and storing files
+        self.num_workers = num_workers
+
+        self.verbose = verbose
+
+        # File in each installed runtime naming its manifest
+        self.RUNTIME_ID_FILE = '.artoo-runtime'
+
+        for directory in [self.objects_dir, self.manifests_dir, self.runtimes_dir]:
+            os.makedirs(directory, exist_ok=True)
+
+    def print_wrapper(self, to_print):
+        # Wrapper for python print that checks verbosity status
+        if self.verbose:
+            print(to_print)
+
+    def hash_file(self, path):
+        # Returns the SHA-256 hex digest of the file at path
+        sha = hashlib.sha256()
+        with open(path, 'rb') as fid:
+            for chunk in iter(lambda: fid.read(1024*1024), b''):
+                sha.update(chunk)
+        return sha.hexdigest()
+
+    def get_object_path(self, object_id):
+        # Returns the path of a stored file
+        return os.path.join(self.objects_dir, object_id[:2], object_id[2:])
+
+    def get_manifest_path(self, name):
+        # Returns the path of the manifest for runtime name
+        return os.path.join(self.manifests_dir, '{}.json'.format(name))
+
+    def get_runtime_path(self, name):
+        # Returns the directory runtime name is installed in
+        return os.path.join(self.runtimes_dir, name)
+
+    def check_name(self, name):
+        # Raise ValueError unless name can be used as a runtime name
+        if not name or name.startswith('.') or os.sep in name or name != os.path.basename(name):
+            raise ValueError('Invalid runtime name: {}'.format(name))
+
+    def store_file(self, path):
+        # Store the file at path (if its content isn't stored already)
+        # Returns its object ID and the number of bytes newly stored
+        executable = os.stat(path).st_mode & stat.S_IXUSR
+        object_id = self.hash_file(path) + ('x' if executable else '')
+        object_path = self.get_object_path(object_id)
+        if os.path.exists(object_path):
+            return object_id, 0
+        os.makedirs(os.path.dirname(object_path), exist_ok=True)
+        # Copy to a temporary name first so a partly copied file is never stored
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(object_path))
+        os.close(fd)
+        try:
+            shutil.copyfile(path, temp_path)
+            os.chmod(temp_path, 0o555 if executable else 0o444)
+            os.replace(temp_path, object_path)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+        return object_id, os.path.getsize(object_path)
+
+    def scan_source(self, source_dir):
+        # Returns lists of the directories, files and symbolic links under source_dir,
+        # as paths relative to it. Symbolic links are (path, target) tuples, with
+        # absolute targets inside source_dir made relative and others left out.
+        source_dir = os.path.realpath(source_dir)
+        dirs, files, links = [], [], []
+        for root, dirnames, filenames in os.walk(source_dir):
+            rel_root = os.path.relpath(root, source_dir)
+            for name in dirnames + filenames:
+                path = os.path.join(root, name)
+                rel_path = os.path.normpath(os.path.join(rel_root, name))
+                if os.path.islink(path):
+                    target = os.readlink(path)
+                    resolved = os.path.normpath(os.path.join(root, target))
+                    if os.path.commonpath([resolved, source_dir]) != source_dir:
+                        print('Leaving out {}, which links outside the runtime to {}'.format(rel_path, target))
+                        continue
+                    links.append((rel_path, os.path.relpath(resolved, root)))
+                elif os.path.isdir(path):
+                    dirs.append(rel_path)
+                elif os.path.isfile(path):
+                    files.append(rel_path)
+        return dirs, files, links
+
+    def add(self, name, source_dir):
+        # Store the files of source_dir and record them as runtime name
+        # Returns the manifest
+        self.check_name(name)
+        dirs, files, links = self.scan_source(source_dir)
+        source_dir = os.path.realpath(source_dir)
+        with ThreadPoolExecutor(max_workers=self.num_workers) as executor:
+            stored = list(executor.map(lambda rel_path: self.store_file(os.path.join(source_dir, rel_path)), files))
+        num_new_bytes = sum(new_bytes for object_id, new_bytes in stored)
+        manifest = {'name': name,
+                    'source': source_dir,
+                    'dirs': sorted(dirs),
+                    'files': {rel_path: object_id for rel_path, (object_id, new_bytes) in zip(files, stored)},
+                    'links': {rel_path: target for rel_path, target in links}}
+        manifest_path = self.get_manifest_path(name)
+        with open(manifest_path + '.tmp', 'w') as fid:
+            json.dump(manifest, fid, indent=1, sort_keys=True)
+        os.replace(manifest_path + '.tmp', manifest_path)
+        print('Stored runtime {}: {} files, {} MB new'.format(name, len(files), round(num_new_bytes/1024/1024, 1)))
+        return manifest
+
+    def load_manifest(self, name):
+        # Returns the manifest of runtime name
+        self.check_name(name)
+        with open(self.get_manifest_path(name)) as fid:
+            return json.load(fid)
+
+    def get_manifest_id(self, name):
+        # Returns a hash identifying the content of runtime name
+        return self.hash_file(self.get_manifest_path(name))
+
+    def set_writable(self, path, writable):
+        # Make the directories under path (not the stored files) writable or not
+        for root, dirnames, filenames in os.walk(path, topdown=writable):
+            os.chmod(root, 0o755 if writable else 0o555)
+
+    def install(self, name):
+        # Build runtime name in runtimes_dir by hard linking stored files,
+        # replacing any runtime installed with that name
+        manifest = self.load_manifest(name)
+        runtime_path = self.get_runtime_path(name)
+        build_path = tempfile.mkdtemp(prefix='.{}.'.format(name), dir=self.runtimes_dir)
+        try:
+            for rel_path in manifest['dirs']:
+                os.makedirs(os.path.join(build_path, rel_path), exist_ok=True)
+            for rel_path, object_id in manifest['files'].items():
+                os.link(self.get_object_path(object_id), os.path.join(build_path, rel_path))
+            for rel_path, target in manifest['links'].items():
+                os.symlink(target, os.path.join(build_path, rel_path))
+            with open(os.path.join(build_path, self.RUNTIME_ID_FILE), 'w') as fid:
+                fid.write('{} {}\n'.format(name, self.get_manifest_id(name)))
+            os.chmod(os.path.join(build_path, self.RUNTIME_ID_FILE), 0o444)
+            self.set_writable(build_path, False)
+        except BaseException:
+            self.delete_tree(build_path)
+            raise
+        # Swap the new runtime in, then delete the old one
+        old_path = None
+        if os.path.lexists(runtime_path):
+            old_path = tempfile.mkdtemp(prefix='.{}.old.'.format(name), dir=self.runtimes_dir)
+            os.rmdir(old_path)
+            os.rename(runtime_path, old_path)
+        os.rename(build_path, runtime_path)
+        if old_path:
+            self.delete_tree(old_path)
+        print('Installed runtime {} in {}'.format(name, runtime_path))
+
+    def delete_tree(self, path):
+        # Delete an installed runtime (or a partly built one)
+        if os.path.isdir(path) and not os.path.islink(path):
+            self.set_writable(path, True)
+            shutil.rmtree(path)
+        elif os.path.lexists(path):
+            os.remove(path)
+
+    def remove(self, name):
+        # Uninstall runtime name and delete its manifest
+        # Its stored files are deleted by the next gc
+        self.check_name(name)
+        self.delete_tree(self.get_runtime_path(name))
+        if os.path.exists(self.get_manifest_path(name)):
+            os.remove(self.get_manifest_path(name))
+        print('Removed runtime {}'.format(name))
+
+    def list_names(self):
+        # Returns the names of the stored runtimes
+        return sorted(filename[:-len('.json')] for filename in os.listdir(self.manifests_dir)
+                      if filename.endswith('.json'))
+
+    def describe(self, name):
+        # Returns a one line description of runtime name
+        manifest = self.load_manifest(name)
+        num_bytes = sum(os.path.getsize(self.get_object_path(object_id))
+                        for object_id in set(manifest['files'].values())
+                        if os.path.exists(self.get_object_path(object_id)))
+        installed = os.path.isdir(self.get_runtime_path(name))
+        return '{}: {} files, {} MB, from {}{}'.format(name, len(manifest['files']), round(num_bytes/1024/1024, 1),
+                                                   manifest['source'], '' if installed else ' (not installed)')
+
+    def gc(self):
+        # Delete stored files which no runtime uses
+        # Returns the number of files and bytes deleted
+        used = set()
+        for name in self.list_names():
+            used.update(self.load_manifest(name)['files'].values())
+        num_files, num_bytes = 0, 0
+        for prefix in os.listdir(self.objects_dir):
+            prefix_dir = os.path.join(self.objects_dir, prefix)
+            for filename in os.listdir(prefix_dir):
+                if prefix + filename not in used:
+                    path = os.path.join(prefix_dir, filename)
+                    num_bytes += os.path.getsize(path)
+                    os.remove(path)
+                    num_files += 1
+        return num_files, num_bytes
+
+    def verify(self, name):
+        # Check that the stored files of runtime name still have the content
+        # they were stored with, and that its installed files are those
+        # stored files. Returns a list of problems, empty if there are none.
+        manifest = self.load_manifest(name)
+        runtime_path = self.get_runtime_path(name)
+        installed = os.path.isdir(runtime_path)
+        def check_file(item):
+            rel_path, object_id = item
+            object_path = self.get_object_path(object_id)
+            if not os.path.exists(object_path):
+                return '{}: stored file {} is missing'.format(rel_path, object_id)
+            if self.hash_file(object_path) != object_id.rstrip('x'):
+                return '{}: stored file {} has been modified'.format(rel_path, object_id)
+            if os.stat(object_path).st_mode & 0o222:
+                return '{}: stored file {} is writable'.format(rel_path, object_id)
+            if installed:
+                try:
+                    if not os.path.samefile(object_path, os.path.join(runtime_path, rel_path)):
+                        return '{}: installed file is not the stored file'.format(rel_path)
+                except OSError:
+                    return '{}: installed file is missing'.format(rel_path)
+            return None
+        with ThreadPoolExecutor(max_workers=self.num_workers) as executor:
+            problems = [problem for problem in executor.map(check_file, manifest['files'].items()) if problem]
+        if not installed:
+            problems.append('not installed in {}'.format(runtime_path))
+        return problems
@@ -0,0 +1,505 @@
+"""
+Sandbox is a module containing the Sandbox, which runs code in
+SELinux sandboxed processes with resource limits and collects
+their output, exit code and resource usage.
+
+It doesn't need a Slack connection, so it is shared by Artoo and
+by executor workers running jobs for Artoo on other hosts.
+
+Copyright (c) 2016 Donald E. Willcox
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import os
+import shutil
+import time
+import select
+import signal
+import asyncio
+import resource
+import threading
+from subprocess import Popen, PIPE, DEVNULL
+from tempfile import NamedTemporaryFile
+from WarmPool import WarmPool
+from JobPool import JobPool
+from OutputBuffer import OutputBuffer
+
+# Python program run by warm interpreters and for code delivered on stdin:
+# import the modules given as arguments, then read one job from stdin and
+# run it in a fresh __main__ module, so objects it defines can be pickled
+PYTHON_STDIN_BOOTSTRAP = '''
+import sys, types, traceback
+for module in sys.argv[1:]:
+    try:
+        __import__(module)
+    except ImportError:
+        pass
+code = sys.stdin.read()
+sys.argv = ['-']
+main_module = types.ModuleType('__main__')
+main_module.__builtins__ = __builtins__
+sys.modules['__main__'] = main_module
+try:
+    exec(compile(code, '<stdin>', 'exec'), main_module.__dict__)
+except SystemExit:
+    raise
+except BaseException:
+    etype, value, tb = sys.exc_info()
+    traceback.print_exception(etype, value, tb.tb_next)
+    sys.exit(1)
+'''
+
+# Bash program which reads all of stdin and then runs it, so that commands
+# in the job which read stdin don't read the rest of the job instead
+BASH_STDIN_BOOTSTRAP = 'eval "$(cat)"'
+
+class Sandbox(object):
+    def __init__(self, metrics, verbose=False, limits=None, use_sandbox=True, diskless=False,
+                 warm_pool_size=0, prewarm_modules=(), stream_interval=3, job_pool=None,
+                 runtime=None):
+        # Metrics recording how long processes take to start and run
+        self.metrics = metrics
+
+        # Verbose status
+        self.verbose = verbose
+
+        # Timeout for running external processes
+        self.PROC_TIMEOUT_SECS = 300 # 5 minutes
+
+        # Bytes of stdout and of stderr kept from each process
+        self.MAX_OUTPUT_BYTES = 64*1024
+
+        # Seconds to wait for a process's pipes to close after it exits
+        self.PIPE_DRAIN_SECS = 5
+
+        # Seconds between checks of a running process's output against its limit
+        self.LIMIT_CHECK_SECS = 0.5
+
+        # Per-job resource limits, None (or missing) for no limit:
+        # 'as': address space in bytes, 'cpu': CPU seconds,
+        # 'nproc': processes, 'output': bytes written to stdout and stderr
+        self.limits = {'as': None, 'cpu': None, 'nproc': None, 'output': None}
+        if limits:
+            self.limits.update(limits)
+
+        # Seconds between calls to a running job's progress function
+        self.stream_interval = stream_interval
+
+        # Threads for work which blocks while the event loop runs
+        self.job_pool = job_pool
+        if self.job_pool is None:
+            self.job_pool = JobPool(1)
+
+        # Get the SELinux sandbox tmp directory and prepare run commands
+        self.artoo_dir = os.getcwd()
+        self.sbox_home = 'sbox_home'
+        self.sbox_home_dir = os.path.join(self.artoo_dir, self.sbox_home)
+        self.sbox_tmp  = 'tmp'
+        self.sbox_home_tmp  = os.path.join(self.sbox_home,self.sbox_tmp)
+        self.sbox_tmp_dir = os.path.join(self.artoo_dir, self.sbox_home_tmp)
+        self.se_sbox_run = ['sandbox', '-M',
+                            '-H', self.sbox_home,
+                            '-T', self.sbox_home_tmp]
+
+        # Runtime installed by artoo_provision.py in sbox_home/runtimes to put
+        # first on the PATH, None to use the sbox_anaconda copy
+        self.runtime = runtime
+        self.runtime_dir = os.path.join(self.sbox_home_dir, 'sbox_anaconda')
+        if self.runtime:
+            self.runtime_dir = os.path.join(self.sbox_home_dir, 'runtimes', self.runtime)
+            if not os.path.isdir(self.runtime_dir):
+                print('Runtime {} is not installed in {}'.format(self.runtime, self.runtime_dir))
+
+        # Without the sandbox (for development and benchmarks only!) programs
+        # run directly, in the sandbox home directory
+        self.use_sandbox = use_sandbox
+        if not self.use_sandbox:
+            self.se_sbox_run = []
+
+        # Deliver code to interpreters on stdin instead of in temporary files
+        # in the sandbox tmp directory (if diskless is True)
+        # Python code still runs as the __main__ module, as it does from a file
+        self.diskless = diskless
+        self.stdin_commands = {'python': ['python', '-c', PYTHON_STDIN_BOOTSTRAP],
+                               'bash': ['bash', '-c', BASH_STDIN_BOOTSTRAP]}
+
+        # Pool of sandboxed python interpreters started ahead of time,
+        # with prewarm_modules already imported (disabled if size is 0)
+        self.prewarm_modules = list(prewarm_modules)
+        self.warm_pool = None
+        if warm_pool_size > 0:
+            self.warm_pool = WarmPool(self.spawn_warm_python, warm_pool_size, verbose)
+
+        # Dict mapping interpreters (keys) to runtime version strings (values)
+        self.runtime_versions = {}
+
+        self.metrics.describe('artoo_halted_total', 'Jobs halted for running too long or writing too much output.')
+        if self.warm_pool:
+            self.metrics.register_gauge('artoo_warm_pool_hits', lambda: self.warm_pool.hits,
+                                        'Python jobs which found a warm interpreter.')
+            self.metrics.register_gauge('artoo_warm_pool_misses', lambda: self.warm_pool.misses,
+                                        'Python jobs which had to start an interpreter.')
+
+    def print_wrapper(self, to_print):
+        # Wrapper for python print that checks verbosity status
+        if self.verbose:
+            print(to_print)
+
+    def form_se_cmd(self, program_cmd):
+        # Returns the Popen command for a SELinux sandboxed
+        sbox_run_cmd = self.se_sbox_run + program_cmd
+        self.print_wrapper(sbox_run_cmd)
+        return sbox_run_cmd
+
+    def get_process_env(self):
+        # Returns the environment for sandboxed processes, with the
+        # sandbox runtime first on the PATH
+        proc_env = os.environ.copy()
+        sbox_pypath = os.path.join(self.runtime_dir,'bin')
+        proc_env['PATH'] = sbox_pypath + ':' + proc_env['PATH']
+        return proc_env
+
+    def apply_limits(self, pid):
+        # Apply the per-job resource limits to the process pid
+        # This happens as soon as the process starts, while the sandbox is
+        # still being set up, and the limits are inherited by its children.
+        rlimits = [(resource.RLIMIT_AS, self.limits.get('as')),
+                   (resource.RLIMIT_CPU, self.limits.get('cpu')),
+                   (resource.RLIMIT_NPROC, self.limits.get('nproc'))]
+        for rlimit, value in rlimits:
+            if value is not None:
+                try:
+                    resource.prlimit(pid, rlimit, (int(value), int(value)))
+                except (OSError, ValueError) as err:
+                    print('Could not set resource limit on process {}: {}'.format(pid, err))
+
+    def get_process_cwd(self):
+        # Returns the working directory for processes, None to leave it to the sandbox
+        if self.use_sandbox:
+            return None
+        return self.sbox_home_dir
+
+    def spawn_process(self, program_cmd, stdin=DEVNULL):
+        # Starts a sandboxed subprocess using Popen and returns it
+        # The subprocess leads a new process group so all of it can be killed
+        proc_env = self.get_process_env()
+        sbox_run_program = self.form_se_cmd(program_cmd)
+        with self.metrics.timer('spawn'):
+            proc = Popen(sbox_run_program, stdin=stdin, stdout=PIPE, stderr=PIPE, env=proc_env,
+                         cwd=self.get_process_cwd(), start_new_session=True)
+        self.apply_limits(proc.pid)
+        return proc
+
+    def kill_process(self, proc):
+        # Kill a subprocess and everything in its process group
+        # Popen.kill would poll first, reaping the process before
+        # wait_process can collect its resource usage, so signal it directly
+        try:
+            os.killpg(proc.pid, signal.SIGKILL)
+        except OSError:
+            if proc.returncode is None:
+                try:
+                    os.kill(proc.pid, signal.SIGKILL)
+                except OSError:
+                    pass
+
+    def wait_process(self, proc, timeout=None):
+        # Wait up to timeout seconds (None to wait forever) for proc to exit,
+        # reaping it with wait4 to collect its resource usage.
+        # Return EXITCODE and RUSAGE, or None and None if it's still running
+        if timeout is not None:
+            try:
+                pidfd = os.pidfd_open(proc.pid)
+            except (AttributeError, OSError):
+                pidfd = None
+            if pidfd is not None:
+                try:
+                    select.select([pidfd], [], [], timeout)
+                finally:
+                    os.close(pidfd)
+                pid, status, rusage = os.wait4(proc.pid, os.WNOHANG)
+            else:
+                # No pidfd support, so poll, keeping the status of the wait4 that reaps it
+                deadline = time.time() + timeout
+                pid, status, rusage = os.wait4(proc.pid, os.WNOHANG)
+                while pid == 0 and time.time() < deadline:
+                    time.sleep(0.05)
+                    pid, status, rusage = os.wait4(proc.pid, os.WNOHANG)
+            if pid == 0:
+                return None, None
+        else:
+            pid, status, rusage = os.wait4(proc.pid, 0)
+        # Let Popen know the process has been reaped
+        proc.returncode = os.waitstatus_to_exitcode(status)
+        return proc.returncode, rusage
+
+    def get_usage(self, start_time, rusage=None):
+        # Returns a dictionary describing the resources used by a job
+        usage = {'wall_secs': time.time() - start_time}
+        if rusage:
+            usage['user_secs'] = rusage.ru_utime
+            usage['sys_secs'] = rusage.ru_stime
+            usage['max_rss_kb'] = rusage.ru_maxrss
+        return usage
+
+    def format_usage(self, usage):
+        # Returns a one line description of a job's resource usage
+        usage_text = 'wall {:.2f} s'.format(usage['wall_secs'])
+        if 'user_secs' in usage:
+            usage_text += ', cpu {:.2f} s user + {:.2f} s sys, peak memory {:.1f} MB'.format(
+                usage['user_secs'], usage['sys_secs'], usage['max_rss_kb']/1024)
+        return usage_text
+
+    def record_run(self, exitcode, usage):
+        # Record the time a process ran for, and whether it was halted, in the metrics
+        self.metrics.observe('artoo_stage_seconds', usage['wall_secs'], stage='run')
+        if not isinstance(exitcode, int):
+            reason = 'output' if 'output' in exitcode else 'timeout'
+            self.metrics.increment('artoo_halted_total', reason=reason)
+
+    def over_output_limit(self, out_buf, err_buf):
+        # Returns True if a job has written more output than its limit
+        output_limit = self.limits.get('output')
+        return output_limit is not None and out_buf.num_bytes + err_buf.num_bytes > output_limit
+
+    def write_input(self, proc, input_data):
+        # Write input_data to the stdin of proc and close it
+        try:
+            proc.stdin.write(input_data)
+            proc.stdin.close()
+        except OSError:
+            # The process exited without reading all its input
+            pass
+
+    def finish_process(self, proc, input_data=None, progress=None):
+        # Sends input_data to a subprocess and waits for it to finish, reading
+        # its output as it arrives and calling progress(out_buf, err_buf) every
+        # stream_interval seconds while it runs.
+        # Return STDOUT, STDERR, EXITCODE, and resource USAGE
+        start_time = time.time()
+        out_buf = OutputBuffer(self.MAX_OUTPUT_BYTES)
+        err_buf = OutputBuffer(self.MAX_OUTPUT_BYTES)
+        pipe_threads = [threading.Thread(target=out_buf.read_from, args=(proc.stdout,), daemon=True),
+                        threading.Thread(target=err_buf.read_from, args=(proc.stderr,), daemon=True)]
+        if input_data is not None:
+            pipe_threads.append(threading.Thread(target=self.write_input, args=(proc, input_data), daemon=True))
+        for pipe_thread in pipe_threads:
+            pipe_thread.start()
+
+        deadline = start_time + self.PROC_TIMEOUT_SECS
+        last_progress = start_time
+        exitcode = None
+        while exitcode is None:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                halted = 'Halted execution after {} seconds'.format(self.PROC_TIMEOUT_SECS)
+                break
+            exitcode, rusage = self.wait_process(proc, min(remaining, self.LIMIT_CHECK_SECS))
+            if exitcode is not None:
+                break
+            if self.over_output_limit(out_buf, err_buf):
+                halted = 'Halted execution after more than {} bytes of output'.format(self.limits['output'])
+                break
+            if progress and time.time() - last_progress >= self.stream_interval:
+                last_progress = time.time()
+                progress(out_buf, err_buf)
+        if exitcode is None:
+            self.kill_process(proc)
+            unused_exitcode, rusage = self.wait_process(proc)
+            exitcode = halted
+
+        for pipe_thread in pipe_threads:
+            pipe_thread.join(self.PIPE_DRAIN_SECS)
+        usage = self.get_usage(start_time, rusage)
+        self.record_run(exitcode, usage)
+        self.print_wrapper('Process {} used {}'.format(proc.pid, self.format_usage(usage)))
+        return out_buf.getvalue(), err_buf.getvalue(), exitcode, usage
+
+    def open_process(self, program_cmd, progress=None):
+        # Opens a subprocess using Popen
+        # Return STDOUT, STDERR, EXITCODE, and resource USAGE
+        proc = self.spawn_process(program_cmd)
+        return self.finish_process(proc, progress=progress)
+
+    def spawn_warm_python(self):
+        # Starts a sandboxed python interpreter waiting for code on stdin
+        program_cmd = ['python', '-c', PYTHON_STDIN_BOOTSTRAP] + self.prewarm_modules
+        return self.spawn_process(program_cmd, stdin=PIPE)
+
+    def acquire_warm_process(self, interpreter):
+        # Returns a warm process for interpreter, None if there isn't one ready
+        if self.warm_pool and interpreter == 'python':
+            return self.warm_pool.acquire()
+        return None
+
+    async def async_read_stream(self, stream, buf):
+        # Read an asyncio stream until it is closed, adding everything read to buf
+        while True:
+            data = await stream.read(65536)
+            if not data:
+                break
+            buf.write(data)
+
+    async def async_write_input(self, proc, input_data):
+        # Event loop version of write_input
+        try:
+            proc.stdin.write(input_data)
+            await proc.stdin.drain()
+            proc.stdin.close()
+        except OSError:
+            pass
+
+    async def async_open_process(self, program_cmd, progress=None, input_data=None):
+        # Event loop version of open_process using asyncio subprocesses
+        # progress is called on the job pool, since it may block
+        # The event loop reaps the process, so USAGE only has the wall time
+        # Return STDOUT, STDERR, EXITCODE, and resource USAGE
+        start_time = time.time()
+        proc_env = self.get_process_env()
+        sbox_run_program = self.form_se_cmd(program_cmd)
+        # Without input to pass, give the job an empty stdin rather than Artoo's own
+        stdin = PIPE if input_data is not None else DEVNULL
+        with self.metrics.timer('spawn'):
+            proc = await asyncio.create_subprocess_exec(*sbox_run_program, stdin=stdin,
+                                                        stdout=PIPE, stderr=PIPE, env=proc_env,
+                                                        cwd=self.get_process_cwd(),
+                                                        start_new_session=True)
+        self.apply_limits(proc.pid)
+        # Read the pipes separately from waiting so output isn't lost on a timeout
+        out_buf = OutputBuffer(self.MAX_OUTPUT_BYTES)
+        err_buf = OutputBuffer(self.MAX_OUTPUT_BYTES)
+        pipe_tasks = [self.async_read_stream(proc.stdout, out_buf),
+                      self.async_read_stream(proc.stderr, err_buf)]
+        if input_data is not None:
+            pipe_tasks.append(self.async_write_input(proc, input_data))
+        read_pipes = asyncio.gather(*pipe_tasks)
+
+        wait_proc = asyncio.ensure_future(proc.wait())
+        deadline = start_time + self.PROC_TIMEOUT_SECS
+        last_progress = start_time
+        exitcode = None
+        while exitcode is None:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                halted = 'Halted execution after {} seconds'.format(self.PROC_TIMEOUT_SECS)
+                break
+            done, pending = await asyncio.wait([wait_proc], timeout=min(remaining, self.LIMIT_CHECK_SECS))
+            if done:
+                exitcode = wait_proc.result()
+                break
+            if self.over_output_limit(out_buf, err_buf):
+                halted = 'Halted execution after more than {} bytes of output'.format(self.limits['output'])
+                break
+            if progress and time.time() - last_progress >= self.stream_interval:
+                last_progress = time.time()
+                self.job_pool.submit(progress, out_buf, err_buf)
+        if exitcode is None:
+            self.kill_process(proc)
+            await wait_proc
+            exitcode = halted
+
+        try:
+            await asyncio.wait_for(read_pipes, self.PIPE_DRAIN_SECS)
+        except asyncio.TimeoutError:
+            pass
+        usage = self.get_usage(start_time)
+        self.record_run(exitcode, usage)
+        self.print_wrapper('Process {} used {}'.format(proc.pid, self.format_usage(usage)))
+        return out_buf.getvalue(), err_buf.getvalue(), exitcode, usage
+    
+    def write_to_temp(self, content):
+        # Write content to a NamedTemporaryFile and return the file handle
+        # Make the NamedTemporaryFile in the SELinux sandbox tmp directory
+        with self.metrics.timer('write_temp'):
+            ftemp = NamedTemporaryFile(mode='w', delete=False, dir=self.sbox_tmp_dir)
+            ftemp.write(content)
+            ftemp.close()
+        return ftemp
+
+    def delete_temp(self, temp_handle):
+        # Delete the NamedTemporaryFile with handle temp_handle
+        self.print_wrapper('Deleting file: {}'.format(temp_handle.name))
+        os.remove(temp_handle.name)
+
+    def get_se_ftemp_path(self, ftemp_name):
+        return os.path.join(self.sbox_tmp, os.path.basename(ftemp_name))
+    
+    def run_code(self, interpreter, code, progress=None):
+        # Execute code with interpreter using a warm process if one is ready,
+        # otherwise by spawning a process and passing it the code on stdin
+        # (if diskless) or in a temporary file.
+        warm_proc = self.acquire_warm_process(interpreter)
+        if warm_proc:
+            self.print_wrapper('Executing {} code in warm process: {}'.format(interpreter, warm_proc.pid))
+            return self.finish_process(warm_proc, code.encode(), progress)
+        if self.diskless and interpreter in self.stdin_commands:
+            self.print_wrapper('Executing {} code on stdin'.format(interpreter))
+            proc = self.spawn_process(self.stdin_commands[interpreter], stdin=PIPE)
+            return self.finish_process(proc, code.encode(), progress)
+        ftemp = self.write_to_temp(code)
+        self.print_wrapper('Executing {} code in temp file: {}'.format(interpreter, ftemp.name))
+        ftemp_se_path = self.get_se_ftemp_path(ftemp.name)
+        try:
+            out, err, exitcode, usage = self.open_process([interpreter, ftemp_se_path], progress)
+        finally:
+            # Delete temporary file
+            self.delete_temp(ftemp)
+        return out, err, exitcode, usage
+
+    async def async_run_code(self, interpreter, code, progress=None):
+        # Event loop version of run_code
+        warm_proc = self.acquire_warm_process(interpreter)
+        if warm_proc:
+            self.print_wrapper('Executing {} code in warm process: {}'.format(interpreter, warm_proc.pid))
+            return await self.job_pool.submit_async(asyncio.get_event_loop(), self.finish_process,
+                                                     warm_proc, code.encode(), progress)
+        if self.diskless and interpreter in self.stdin_commands:
+            self.print_wrapper('Executing {} code on stdin'.format(interpreter))
+            return await self.async_open_process(self.stdin_commands[interpreter], progress, code.encode())
+        ftemp = self.write_to_temp(code)
+        self.print_wrapper('Executing {} code in temp file: {}'.format(interpreter, ftemp.name))
+        ftemp_se_path = self.get_se_ftemp_path(ftemp.name)
+        try:
+            out, err, exitcode, usage = await self.async_open_process([interpreter, ftemp_se_path], progress)
+        finally:
+            # Delete temporary file
+            self.delete_temp(ftemp)
+        return out, err, exitcode, usage
+
+    def get_runtime_version(self, interpreter):
+        # Returns a string identifying the interpreter found on the sandbox PATH,
+        # so cached results aren't reused after the runtime changes
+        if interpreter not in self.runtime_versions:
+            interpreter_path = shutil.which(interpreter, path=self.get_process_env()['PATH'])
+            version = interpreter
+            if interpreter_path:
+                interpreter_stat = os.stat(interpreter_path)
+                version = '{}:{}:{}'.format(os.path.realpath(interpreter_path),
+                                            interpreter_stat.st_size,
+                                            interpreter_stat.st_mtime)
+                # Provisioned runtimes name the manifest they were installed from
+                try:
+                    with open(os.path.join(self.runtime_dir, '.artoo-runtime')) as fid:
+                        version += ':' + fid.read().strip()
+                except OSError:
+                    pass
+            self.runtime_versions[interpreter] = version
+        return self.runtime_versions[interpreter]
+
@@ -0,0 +1,391 @@
+"""
+SessionPool is a module containing the Session, a sandboxed python
+interpreter kept running so that one user's snippets share a namespace,
+and the SessionPool, which keeps the Sessions of every user and channel
+and ends those which are idle or use too much memory.
+
+A Session reads snippets framed by their length from a private copy of
+its stdin. After each snippet it writes a line starting with a random
+token (and holding the snippet's exit status) to stdout and stderr, which
+marks the end of that snippet's output.
+
+Copyright (c) 2016 Donald E. Willcox
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import os
+import time
+import secrets
+import threading
+from collections import OrderedDict
+from subprocess import PIPE
+from OutputBuffer import OutputBuffer
+
+# Python program run by sessions: read the end-of-output token, then run
+# each snippet read from the protocol stream in one fresh __main__ module,
+# so objects snippets define can be pickled. Snippets get an empty stdin
+# so they can't read the protocol stream by mistake.
+PYTHON_SESSION_BOOTSTRAP = '''
+import os, sys, types, traceback
+protocol = os.fdopen(os.dup(0), 'rb')
+os.dup2(os.open(os.devnull, os.O_RDONLY), 0)
+sys.stdin = open(os.devnull)
+sys.argv = ['-']
+token = protocol.readline().strip().decode()
+main_module = types.ModuleType('__main__')
+main_module.__builtins__ = __builtins__
+sys.modules['__main__'] = main_module
+namespace = main_module.__dict__
+while True:
+    header = protocol.readline()
+    if not header:
+        break
+    code = protocol.read(int(header)).decode()
+    status = 0
+    try:
+        exec(compile(code, '<session>', 'exec'), namespace)
+    except SystemExit as err:
+        status = err.code if isinstance(err.code, int) else int(err.code is not None)
+    except BaseException:
+        etype, value, tb = sys.exc_info()
+        traceback.print_exception(etype, value, tb.tb_next)
+        status = 1
+    for stream in (sys.stdout, sys.stderr):
+        try:
+            stream.flush()
+        except Exception:
+            pass
+    for stream in (sys.__stdout__, sys.__stderr__):
+        stream.write('\\n\\x00{} {}\\n'.format(token, status))
+        stream.flush()
+'''
+
+class Session(object):
+    def __init__(self, sandbox, key):
+        # Sandbox which starts the session's interpreter and sets its limits
+        self.sandbox = sandbox
+
+        # (user, channel) the session belongs to
+        self.key = key
+
+        # Token marking the end of each snippet's output
+        self.token = secrets.token_hex(16)
+        self.marker = b'\n\x00' + self.token.encode() + b' '
+
+        # Output buffers and exit statuses of the snippet running now,
+        # and whether stdout and stderr have been closed
+        self.cond = threading.Condition()
+        self.buffers = [None, None]
+        self.statuses = [None, None]
+        self.closed = [False, False]
+        self.ended = False
+
+        # Only one snippet runs at a time
+        self.lock = threading.Lock()
+
+        # Number of runs handed this session by SessionPool.get which haven't
+        # started yet, so that it isn't evicted or reaped before they do
+        self.reserved = 0
+
+        self.start_time = time.time()
+        self.last_used = self.start_time
+        self.num_runs = 0
+
+        self.proc = self.sandbox.spawn_process(['python', '-u', '-c', PYTHON_SESSION_BOOTSTRAP], stdin=PIPE)
+        for index, pipe in enumerate([self.proc.stdout, self.proc.stderr]):
+            threading.Thread(target=self.read_stream, args=(index, pipe), daemon=True).start()
+        self.send(self.token.encode() + b'\n')
+
+    def send(self, data):
+        # Write data to the session's protocol stream
+        self.proc.stdin.write(data)
+        self.proc.stdin.flush()
+
+    def write_output(self, index, data):
+        # Add data to the output buffer of the running snippet, if any
+        if data and self.buffers[index] is not None:
+            self.buffers[index].write(data)
+
+    def read_stream(self, index, pipe):
+        # Read stdout (index 0) or stderr (index 1) of the session until it
+        # closes, splitting it into snippets' output at each end marker.
+        # The last few bytes are held back in case they start a marker.
+        keep = len(self.marker) + 16
+        pending = b''
+        while True:
+            data = os.read(pipe.fileno(), 65536)
+            with self.cond:
+                if not data:
+                    self.write_output(index, pending)
+                    self.closed[index] = True
+                    self.cond.notify_all()
+                    return
+                pending += data
+                while True:
+                    start = pending.find(self.marker)
+                    if start < 0:
+                        break
+                    end = pending.find(b'\n', start + len(self.marker))
+                    if end < 0:
+                        break
+                    self.write_output(index, pending[:start])
+                    self.statuses[index] = pending[start + len(self.marker):end].decode(errors='replace')
+                    pending = pending[end + 1:]
+                    self.cond.notify_all()
+                if len(pending) > keep:
+                    self.write_output(index, pending[:-keep])
+                    pending = pending[-keep:]
+
+    def is_alive(self):
+        # Returns True if the session can run more snippets
+        return not self.ended and self.proc.poll() is None
+
+    def is_busy(self):
+        # Returns True if a snippet is running or about to run
+        return self.reserved > 0 or self.lock.locked()
+
+    def get_memory(self):
+        # Returns the resident memory in bytes of every process in the
+        # session's process group
+        total = 0
+        page_size = os.sysconf('SC_PAGE_SIZE')
+        for entry in os.listdir('/proc'):
+            if not entry.isdigit():
+                continue
+            try:
+                with open('/proc/{}/stat'.format(entry)) as fstat:
+                    fields = fstat.read().rsplit(')', 1)[1].split()
+            except (OSError, IndexError):
+                continue
+            # After the command come the state, parent pid, process group, ... and rss (in pages)
+            if int(fields[2]) == self.proc.pid:
+                total += int(fields[21])*page_size
+        return total
+
+    def run(self, code, progress=None):
+        # Run code in the session, calling progress(out_buf, err_buf) every
+        # stream_interval seconds while it runs. The session is ended if the
+        # snippet is halted or the interpreter exits.
+        # Return STDOUT, STDERR, EXITCODE, and resource USAGE
+        with self.lock:
+            with self.cond:
+                self.reserved = max(0, self.reserved - 1)
+            start_time = time.time()
+            if self.ended:
+                usage = self.sandbox.get_usage(start_time)
+                return '', '', 'Session ended before the code could run', usage
+            out_buf = OutputBuffer(self.sandbox.MAX_OUTPUT_BYTES)
+            err_buf = OutputBuffer(self.sandbox.MAX_OUTPUT_BYTES)
+            with self.cond:
+                self.buffers = [out_buf, err_buf]
+                self.statuses = [None, None]
+            data = code.encode()
+            try:
+                self.send('{}\n'.format(len(data)).encode() + data)
+            except (OSError, ValueError):
+                # The interpreter has exited or the session was ended, which the loop below notices
+                pass
+
+            deadline = start_time + self.sandbox.PROC_TIMEOUT_SECS
+            last_progress = start_time
+            exitcode = None
+            while exitcode is None:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    exitcode = 'Halted execution after {} seconds'.format(self.sandbox.PROC_TIMEOUT_SECS)
+                    break
+                with self.cond:
+                    self.cond.wait_for(lambda: None not in self.statuses or all(self.closed),
+                                       min(remaining, self.sandbox.LIMIT_CHECK_SECS))
+                    if None not in self.statuses:
+                        try:
+                            exitcode = int(self.statuses[0])
+                        except ValueError:
+                            exitcode = self.statuses[0]
+                        break
+                    if all(self.closed):
+                        exitcode = 'Session ended with exit code {}'.format(self.proc.wait())
+                        break
+                if self.sandbox.over_output_limit(out_buf, err_buf):
+                    exitcode = 'Halted execution after more than {} bytes of output'.format(self.sandbox.limits['output'])
+                    break
+                if progress and time.time() - last_progress >= self.sandbox.stream_interval:
+                    last_progress = time.time()
+                    progress(out_buf, err_buf)
+            if not isinstance(exitcode, int):
+                self.end()
+            with self.cond:
+                self.buffers = [None, None]
+            self.num_runs += 1
+            self.last_used = time.time()
+            usage = self.sandbox.get_usage(start_time)
+            self.sandbox.record_run(exitcode, usage)
+            return out_buf.getvalue(), err_buf.getvalue(), exitcode, usage
+
+    def end(self):
+        # Kill the session's interpreter and everything it started
+        self.ended = True
+        if self.proc.poll() is None:
+            self.sandbox.kill_process(self.proc)
+            self.sandbox.wait_process(self.proc)
+        try:
+            self.proc.stdin.close()
+        except OSError:
+            pass
+
+class SessionPool(object):
+    def __init__(self, sandbox, metrics, max_sessions=4, idle_secs=900, max_memory=None, verbose=False):
+        # Sandbox which starts session interpreters
+        self.sandbox = sandbox
+        self.metrics = metrics
+
+        # Most sessions alive at once
+        self.max_sessions = max_sessions
+
+        # Seconds a session may sit idle before it is ended
+        self.idle_secs = idle_secs
+
+        # Bytes of resident memory all sessions together may use, None for no limit
+        self.max_memory = max_memory
+
+        self.verbose = verbose
+
+        # Seconds between checks for idle sessions and memory use
+        self.REAP_INTERVAL_SECS = 10
+
+        # Dict mapping (user, channel) keys to Sessions, least recently used first
+        self.sessions = OrderedDict()
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+
+        self.metrics.describe('artoo_sessions_total', 'Session events: started, ended by users, reaped when idle or evicted.')
+        self.metrics.register_gauge('artoo_sessions_live', lambda: len(self.sessions),
+                                    'Sessions alive.')
+
+        threading.Thread(target=self.reap_loop, daemon=True).start()
+
+    def print_wrapper(self, to_print):
+        # Wrapper for python print that checks verbosity status
+        if self.verbose:
+            print(to_print)
+
+    def end_session(self, session, reason):
+        # End session and record why, after removing it from self.sessions
+        self.print_wrapper('Ending session {} ({})'.format(session.key, reason))
+        session.end()
+        self.metrics.increment('artoo_sessions_total', event=reason)
+
+    def evict_locked(self):
+        # Remove and return the least recently used idle session,
+        # None if every session is busy. Call with self.lock held.
+        for key, session in self.sessions.items():
+            if not session.is_busy():
+                del self.sessions[key]
+                return session
+        return None
+
+    def get(self, key):
+        # Returns the live session for key and whether it was just started,
+        # starting one if needed. Returns None and False if there are already
+        # max_sessions sessions and all of them are busy. The session is
+        # reserved until its run starts, so it isn't evicted or reaped first.
+        evicted = []
+        with self.lock:
+            session = self.sessions.get(key)
+            if session and not session.is_alive():
+                del self.sessions[key]
+                evicted.append((session, 'died'))
+                session = None
+            if session:
+                self.sessions.move_to_end(key)
+                started = False
+            else:
+                while len(self.sessions) >= self.max_sessions:
+                    oldest = self.evict_locked()
+                    if oldest is None:
+                        break
+                    evicted.append((oldest, 'evicted'))
+                if len(self.sessions) >= self.max_sessions:
+                    session = None
+                else:
+                    session = Session(self.sandbox, key)
+                    self.sessions[key] = session
+                    self.metrics.increment('artoo_sessions_total', event='started')
+                started = True
+            if session:
+                with session.cond:
+                    session.reserved += 1
+        for old_session, reason in evicted:
+            self.end_session(old_session, reason)
+        return session, started
+
+    def end(self, key):
+        # End the session for key, returns False if there wasn't one
+        with self.lock:
+            session = self.sessions.pop(key, None)
+        if session is None:
+            return False
+        self.end_session(session, 'ended')
+        return True
+
+    def reap(self):
+        # End sessions idle for more than idle_secs or which have died, then
+        # end the least recently used idle sessions until memory use is under max_memory
+        now = time.time()
+        expired = []
+        with self.lock:
+            for key, session in list(self.sessions.items()):
+                if not session.is_alive():
+                    expired.append((session, 'died'))
+                elif not session.is_busy() and now - session.last_used > self.idle_secs:
+                    expired.append((session, 'reaped'))
+            for session, reason in expired:
+                del self.sessions[session.key]
+        for session, reason in expired:
+            self.end_session(session, reason)
+        if self.max_memory is None:
+            return
+        with self.lock:
+            sessions = list(self.sessions.values())
+        memory = sum(session.get_memory() for session in sessions)
+        while memory > self.max_memory:
+            with self.lock:
+                session = self.evict_locked()
+            if session is None:
+                break
+            memory -= session.get_memory()
+            self.end_session(session, 'evicted')
+
+    def reap_loop(self):
+        # Reap sessions every REAP_INTERVAL_SECS until shutdown
+        while not self.stopped.wait(self.REAP_INTERVAL_SECS):
+            try:
+                self.reap()
+            except Exception as err:
+                print('Could not reap sessions: {}'.format(err))
+
+    def shutdown(self):
+        # End every session and stop the reaper
+        self.stopped.set()
+        with self.lock:
+            sessions = list(self.sessions.values())
+            self.sessions.clear()
+        for session in sessions:
+            session.end()
@@ -25,12 +25,21 @@ SOFTWARE.
 
 import time
 import re
+import asyncio
+import traceback
 import os
 import requests
+from urllib.parse import urlparse
 from slackclient import SlackClient
+from JobPool import JobPool
+from AdmissionControl import AdmissionControl
+from UserDirectory import UserDirectory
+from Cache import LRUCache
+from MessageQueue import MessageQueue
+from Metrics import Metrics
 
 class SlackBotInterface(SlackClient):
-    def __init__(self, bot_id_file, watch_only):
+    def __init__(self, bot_id_file, watch_only, num_workers=1, shared_from=None):
         # Bot identity and token
         self.identity = ''
         self.token    = ''
@@ -47,6 +56,24 @@ class SlackBotInterface(SlackClient):
         # Bot authentication header for downloading files using requests
         self.request_headers = {'Authorization': 'Bearer {}'.format(self.token)}
 
+        # Persistent HTTP session so file downloads reuse connections,
+        # with a connection for each worker
+        self.http_session = requests.Session()
+        http_adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=max(1, num_workers))
+        self.http_session.mount('https://', http_adapter)
+        self.http_session.mount('http://', http_adapter)
+
+        # The bot token is only sent to file URLs with these schemes and hosts
+        self.file_url_schemes = ('https',)
+        self.file_url_hosts = ('files.slack.com',)
+
+        # Largest file to download, and seconds to wait for the server
+        self.MAX_FILE_BYTES = 1024*1024
+        self.DOWNLOAD_TIMEOUT_SECS = 30
+
+        # Downloaded file contents keyed by (file ID, file timestamp)
+        self.file_cache = LRUCache(max_entries=256, max_bytes=16*1024*1024)
+
         # Instructions are alphanumeric with underscores
         # but no other characters are allowed, including spaces
         # The RE is '[self.tag][unicode whitespace][unicode word]'
@@ -55,6 +82,16 @@ class SlackBotInterface(SlackClient):
         # Dict mapping instructions (keys) to functions (values)
         self.instruction_set = {}
 
+        # Dict mapping instructions (keys) to coroutine functions (values)
+        # used in place of instruction_set when running an event loop
+        self.async_instruction_set = {}
+
+        # Event loop when running with async_poll_slack, otherwise None
+        self.event_loop = None
+
+        # Seconds without websocket traffic before pinging Slack in async mode
+        self.ping_interval = 30
+
         # Message buffer
         self.message_buffer = []
 
@@ -64,6 +101,56 @@ class SlackBotInterface(SlackClient):
         # Watch only
         self.watch_only = watch_only
 
+        # EventLog recording every message read from Slack, None to not record them
+        # In watch mode, messages are printed instead if there is no EventLog
+        self.event_log = None
+
+        # Bots serving other workspaces from this process share the job pool,
+        # metrics and admission control of the first bot (shared_from), which
+        # lists all of them in shared_bots
+        self.shared_bots = [self]
+        if shared_from:
+            shared_from.shared_bots.append(self)
+
+        # Pool of worker threads for replying to tagged messages
+        if shared_from:
+            self.job_pool = shared_from.job_pool
+        else:
+            self.job_pool = JobPool(num_workers)
+
+        # Timers and counters for each stage of replying to a message
+        if shared_from:
+            self.metrics = shared_from.metrics
+        else:
+            self.metrics = Metrics()
+        self.metrics.describe('artoo_stage_seconds', 'Seconds spent in each stage of replying to a message.')
+        self.metrics.describe('artoo_request_seconds', 'Seconds from reading a tagged message to queueing its reply.')
+        self.metrics.describe('artoo_requests_total', 'Tagged messages handled, by instruction.')
+        self.metrics.describe('artoo_stage_errors_total', 'Exceptions raised in each stage.')
+        self.metrics.describe('artoo_messages_total', 'Messages sent, retried and dropped by the outgoing queue.')
+        self.metrics.register_gauge('artoo_jobs_pending', self.job_pool.pending,
+                                    'Jobs queued or running on the job pool.')
+
+        # Instructions which run jobs, and the admission control deciding
+        # when they may start, at most num_workers at a time
+        self.admitted_instructions = set()
+        if shared_from:
+            self.admission = shared_from.admission
+        else:
+            self.admission = AdmissionControl(num_workers, metrics=self.metrics)
+
+        # Queue for posting to Slack, paced to stay within rate limits
+        # The gauge adds up the queues of every bot sharing the metrics
+        self.message_queue = MessageQueue(self, metrics=self.metrics)
+        shared_bots = (shared_from or self).shared_bots
+        self.metrics.register_gauge('artoo_message_queue_depth',
+                                    lambda: sum(bot.message_queue.stats()['depth'] for bot in shared_bots),
+                                    'Messages waiting in the outgoing queues.')
+
+        # Cache of user names, refreshed after user_cache_ttl seconds
+        self.user_cache_ttl = 3600
+        self.user_directory = UserDirectory(self, self.user_cache_ttl)
+
     def read_token_from_file(self, file_path):
         # Reads the Bot ID and Token from the file specified in file_path (absolute)
         # Exits with an error if the file isn't supplied or found or the ID and Token aren't present
@@ -105,17 +192,7 @@ class SlackBotInterface(SlackClient):
 
     def lookup_user_name(self, userid):
         # Looks up user name from user id, return None if not found or error
-        self.users_list = self.api_call("users.list")
-        if self.users_list.get('ok'):
-            members = self.users_list.get('members')
-            for member in members:
-                username = member.get('name')
-                id = member.get('id')
-                if id == userid:
-                    return username
-            return None
-        else:
-            return None
+        return self.user_directory.lookup(userid)
 
     def get_message_user_tag(self, tagged_message):
         # Returns the user tag for the user who posted tagged_message
@@ -126,7 +203,8 @@ class SlackBotInterface(SlackClient):
         # Tag the user
         reply_user_tag = ''
         if reply_user_id:
-            reply_user_tag = '<@{}>'.format(self.lookup_user_name(reply_user_id))
+            with self.metrics.timer('users'):
+                reply_user_tag = '<@{}>'.format(self.lookup_user_name(reply_user_id))
         return reply_user_tag
 
     def get_message_text(self, tagged_message):
@@ -144,11 +222,56 @@ class SlackBotInterface(SlackClient):
             file_url = tagged_message['file']['url_private']
         return file_url
 
+    def is_file_url_allowed(self, file_url):
+        # Returns True if file_url may be sent the bot token
+        parsed_url = urlparse(file_url)
+        return (parsed_url.scheme in self.file_url_schemes and
+                parsed_url.hostname in self.file_url_hosts)
+
     def download_file_content(self, file_url):
         # Returns the text of a downloaded file's contents, given its URL
-        # NEED TO SANITIZE file_url to prevent sending bot token to non-slack URL's
-        r = requests.get(file_url, headers=self.request_headers)
-        return r.content.decode()
+        # Returns None if the URL isn't Slack's, the file is too big or the download fails
+        if not self.is_file_url_allowed(file_url):
+            print('Refusing to download file from URL: {}'.format(file_url))
+            return None
+        try:
+            with self.http_session.get(file_url, headers=self.request_headers, stream=True,
+                                       timeout=self.DOWNLOAD_TIMEOUT_SECS) as r:
+                if r.status_code != 200:
+                    print('Could not download file {}: HTTP {}'.format(file_url, r.status_code))
+                    return None
+                content_length = r.headers.get('Content-Length')
+                if content_length and int(content_length) > self.MAX_FILE_BYTES:
+                    print('File is larger than {} bytes: {}'.format(self.MAX_FILE_BYTES, file_url))
+                    return None
+                content = bytearray()
+                for chunk in r.iter_content(chunk_size=65536):
+                    content += chunk
+                    if len(content) > self.MAX_FILE_BYTES:
+                        print('File is larger than {} bytes: {}'.format(self.MAX_FILE_BYTES, file_url))
+                        return None
+        except requests.exceptions.RequestException as err:
+            print('Could not download file {}: {}'.format(file_url, err))
+            return None
+        return content.decode(errors='replace')
+
+    def get_file_content(self, file_info):
+        # Returns the text of the file described by a message's file field,
+        # downloading it only if it isn't cached already
+        file_url = file_info.get('url_private', '')
+        cache_key = None
+        if file_info.get('id'):
+            cache_key = (file_info['id'], file_info.get('timestamp'))
+            content = self.file_cache.get(cache_key)
+            if content is not None:
+                self.metrics.increment('artoo_file_cache_total', result='hit')
+                return content
+            self.metrics.increment('artoo_file_cache_total', result='miss')
+        with self.metrics.timer('download'):
+            content = self.download_file_content(file_url)
+        if content is not None and cache_key:
+            self.file_cache.put(cache_key, content)
+        return content
 
     def get_code_from_regions(self, base_text):
         # Gets code from code regions denoted by ``` (open) and ``` (close)
@@ -172,19 +295,18 @@ class SlackBotInterface(SlackClient):
 
     def get_message_code(self, tagged_message):
         # Extract code from message, return (message_code, file_url)
+        # message_code is '!ODD' if the message has an odd number of ``` fences
         # Determine if there is a file to run or if there are code block(s)
         file_url = self.get_message_file_url(tagged_message)
         message_code = None
         if file_url:
             # Download a file if supplied in file_url
-            message_code = self.download_file_content(file_url)
+            message_code = self.get_file_content(tagged_message['file'])
         else:
             # If no file supplied, extract the code region(s) in this text
             tagged_text = self.get_message_text(tagged_message)
             message_code = self.get_code_from_regions(tagged_text)
-            if message_code=='!ODD':
-                message_code = None
-        if message_code:
+        if message_code and message_code != '!ODD':
             # Use the universal newline support of str.splitlines() to
             # replace the newlines in message_code with the system line ending.
             # I'm joining with '\n' because when writing message_code in text mode
@@ -206,6 +328,27 @@ class SlackBotInterface(SlackClient):
             # If user supplied an instruction I don't recognize, call ins_confused()
             return self.ins_confused(tagged_message)
 
+    def get_message_instruction(self, tagged_text):
+        # Extract Bot instruction from message text, None if there isn't one
+        # If there is more than one tag to Bot, just extract the first instruction
+        instruction = None
+        re_match = re.search(self.re_instruction, tagged_text)
+        if re_match and re_match.group(1):
+            instruction = re_match.group(1)
+        return instruction
+
+    def get_instruction_label(self, instruction):
+        # Returns the name to record metrics for instruction under
+        # Unknown instructions share one name so users can't create new metrics
+        if instruction in self.instruction_set:
+            return instruction
+        return 'unknown'
+
+    def post_reply(self, reply_channel, reply_text):
+        # Queue reply_text to be posted to reply_channel
+        # Return a Future for the Web API response to posting (the first part of) it
+        return self.message_queue.post_message(reply_channel, reply_text, as_user=True)
+
     def reply_tagged_message(self, tagged_message):
         # Given a message which tags Artoo, interpret it, execute action and reply
         
@@ -223,26 +366,77 @@ class SlackBotInterface(SlackClient):
         # Sanity
         if not tagged_text:
             return
-        
-        # If there is more than one tag to Bot, just extract the first instruction
-        instruction = None
-        re_match = re.search(self.re_instruction, tagged_text)
-        if re_match and re_match.group(1):
-            instruction = re_match.group(1)
+        instruction = self.get_message_instruction(tagged_text)
             
         # Execute instruction given the tagged message
-        reply_text = self.execute_instruction(instruction, tagged_message)
+        instruction_label = self.get_instruction_label(instruction)
+        self.metrics.increment('artoo_requests_total', instruction=instruction_label)
+        start_time = time.time()
+        with self.metrics.timer('execute', instruction=instruction_label):
+            reply_text = self.execute_instruction(instruction, tagged_message)
+
+        # Post response to the originating channel
+        # (unless the instruction already replied, returning None)
+        if reply_text is not None:
+            self.post_reply(reply_channel, reply_text)
+        self.metrics.observe('artoo_request_seconds', time.time() - start_time, instruction=instruction_label)
+
+    async def run_blocking(self, function, *args):
+        # Run a blocking function on the job pool without blocking the event loop
+        return await self.job_pool.submit_async(self.event_loop, function, *args)
+
+    async def async_execute_instruction(self, instruction, tagged_message):
+        # Execute the instruction on this message from the event loop
+        # Instructions without a coroutine version run on the job pool
+        if instruction in self.async_instruction_set:
+            return await self.async_instruction_set[instruction](tagged_message)
+        else:
+            return await self.run_blocking(self.execute_instruction, instruction, tagged_message)
 
-        # Post response to the originating channel        
-        self.api_call("chat.postMessage", channel=reply_channel, text=reply_text, as_user=True)
+    async def async_reply_tagged_message(self, tagged_message):
+        # Event loop version of reply_tagged_message
+        reply_channel = tagged_message.get('channel')
+        tagged_text = tagged_message.get('text')
+        if not tagged_text:
+            return
+        instruction = self.get_message_instruction(tagged_text)
+        instruction_label = self.get_instruction_label(instruction)
+        self.metrics.increment('artoo_requests_total', instruction=instruction_label)
+        start_time = time.time()
+        with self.metrics.timer('execute', instruction=instruction_label):
+            reply_text = await self.async_execute_instruction(instruction, tagged_message)
+        if reply_text is not None:
+            self.post_reply(reply_channel, reply_text)
+        self.metrics.observe('artoo_request_seconds', time.time() - start_time, instruction=instruction_label)
+
+    def async_reply_done(self, task):
+        # Callback for finished reply tasks: report exceptions
+        if task.cancelled():
+            return
+        exc = task.exception()
+        if exc:
+            print('Reply task raised an exception:')
+            traceback.print_exception(type(exc), exc, exc.__traceback__)
     
     def filter_tagged_messages(self):
         # Filter the messages in self.message_buffer to determine who they are for.
         # Return immediately unless a message is directed at the Bot
         # Call self.reply_tagged_message() if a message is directed at the Bot
 
+        # Keep the user name cache up to date
+        for message in self.message_buffer:
+            self.user_directory.update_from_event(message)
+
+        # Record the messages, the EventLog writes them in the background
+        if self.event_log:
+            for message in self.message_buffer:
+                self.event_log.write(message)
+
         if self.watch_only:
-            # Just print each message you see if --watch is supplied as an argument.
+            # Just watch the messages if --watch is supplied as an argument,
+            # printing each one you see unless they are recorded
+            if self.event_log:
+                return
             for message in self.message_buffer:
                 print('----------------------')
                 for k in message.keys():
@@ -253,11 +447,56 @@ class SlackBotInterface(SlackClient):
                     # Message has a text field
                     if re.search(self.tag, message['text']):
                         # Message tags Bot, so interpret it.
-                        self.reply_tagged_message(message)
+                        self.dispatch_tagged_message(message)
+
+    def dispatch_tagged_message(self, tagged_message):
+        # Hand a tagged message to the job pool (or the event loop, in async mode)
+        # so the polling loop keeps reading messages while the reply is worked out
+        # Instructions in admitted_instructions wait for admission control first
+        instruction = self.get_message_instruction(tagged_message.get('text', ''))
+        if instruction not in self.admitted_instructions:
+            self.start_reply(tagged_message)
+            return
+        status, detail = self.admission.submit(tagged_message.get('user'), tagged_message.get('channel'),
+                                               lambda ticket: self.start_reply(tagged_message, ticket))
+        if status == 'queued':
+            self.post_admission_reply(tagged_message, "[Queued, position {}] I'll get to this as soon as I can.".format(detail))
+        elif status == 'rejected' and detail == 'user':
+            self.post_admission_reply(tagged_message, "[Sad Whistle] You already have {} requests waiting, please try again when they're done.".format(self.admission.user_queued))
+        elif status == 'rejected':
+            self.post_admission_reply(tagged_message, "[Sad Whistle] I'm too busy right now, please try again in a few minutes.")
+
+    def post_admission_reply(self, tagged_message, text):
+        # Tell the user who posted tagged_message what admission control decided
+        # This runs on the polling loop (or the event loop), so tag the user by ID
+        # rather than looking up their name, which may block on the Web API
+        reply_channel = tagged_message.get('channel')
+        if reply_channel:
+            reply_user_id = tagged_message.get('user')
+            reply_user_tag = '<@{}>'.format(reply_user_id) if reply_user_id else ''
+            self.post_reply(reply_channel, '{} {}'.format(reply_user_tag, text))
+
+    def start_reply(self, tagged_message, ticket=None):
+        # Start replying to a tagged message on the job pool (or the event loop),
+        # telling admission control when it's done if it was admitted with ticket
+        if ticket:
+            self.metrics.observe('artoo_stage_seconds', time.time() - ticket.submit_time, stage='queue')
+        if self.event_loop:
+            task = self.event_loop.create_task(self.async_reply_tagged_message(tagged_message))
+            task.add_done_callback(self.async_reply_done)
+            if ticket:
+                task.add_done_callback(lambda task: self.admission.finish(ticket))
+        else:
+            future = self.job_pool.submit(self.reply_tagged_message, tagged_message)
+            if ticket:
+                future.add_done_callback(lambda future: self.admission.finish(ticket))
 
     def poll_slack(self):
         if self.rtm_connect():
             print("Successfully logged onto Slack!")
+            # Load the user name cache once up front
+            if not self.user_directory.load():
+                print("Could not load the Slack user list, names will be looked up as needed.")
             while True:
                 # Poll Slack for new messages and fill buffer
                 self.message_buffer = self.rtm_read()
@@ -265,4 +504,45 @@ class SlackBotInterface(SlackClient):
                 self.filter_tagged_messages()
                 time.sleep(self.poll_delay)
         else:
-            print("Could not successfully log onto Slack :(")        
+            print("Could not successfully log onto Slack :(")
+
+    async def async_poll_slack(self):
+        # Event-driven replacement for poll_slack: rather than sleeping between
+        # reads, wait until the websocket has data and read it right away.
+        self.event_loop = asyncio.get_event_loop()
+        if not await self.run_blocking(self.rtm_connect):
+            print("Could not successfully log onto Slack :(")
+            return
+        print("Successfully logged onto Slack!")
+        if not await self.run_blocking(self.user_directory.load):
+            print("Could not load the Slack user list, names will be looked up as needed.")
+
+        # The RTM websocket is non-blocking, so it can be watched by the event loop
+        websocket_fd = self.server.websocket.sock.fileno()
+        frames_ready = asyncio.Event()
+        self.event_loop.add_reader(websocket_fd, frames_ready.set)
+        try:
+            while True:
+                try:
+                    await asyncio.wait_for(frames_ready.wait(), self.ping_interval)
+                except asyncio.TimeoutError:
+                    # Quiet connection, make sure it's still alive
+                    self.server.ping()
+                    continue
+                frames_ready.clear()
+                # Read everything available and dispatch it
+                self.message_buffer = self.rtm_read()
+                self.filter_tagged_messages()
+        finally:
+            self.event_loop.remove_reader(websocket_fd)
+
+    def run_event_loop(self, other_bots=()):
+        # Run async_poll_slack in a new event loop until it finishes, along
+        # with the async_poll_slack of each bot in other_bots
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        try:
+            loop.run_until_complete(asyncio.gather(self.async_poll_slack(),
+                                                   *[bot.async_poll_slack() for bot in other_bots]))
+        finally:
+            loop.close()
@@ -0,0 +1,119 @@
+"""
+UserDirectory is a module containing the UserDirectory, a cache
+mapping Slack user IDs to user names.
+
+The directory is loaded once with paginated users.list calls, kept
+fresh from RTM user_change and team_join events, and falls back to a
+single users.info call for users who are missing or whose entry is
+older than the time-to-live.
+
+Copyright (c) 2016 Donald E. Willcox
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import time
+import threading
+from MessageQueue import get_retry_after
+
+class UserDirectory(object):
+    def __init__(self, slack_client, ttl_secs=3600, page_size=200, max_retries=3):
+        # Client used for Web API calls
+        self.slack_client = slack_client
+
+        # Seconds an entry is trusted before it is looked up again
+        self.ttl_secs = ttl_secs
+
+        # Number of members requested per users.list page
+        self.page_size = page_size
+
+        # Times a rate limited call is retried before giving up on it
+        self.max_retries = max_retries
+
+        # Dict mapping user ID (keys) to (user name, time cached) (values)
+        self.users = {}
+        self.lock = threading.Lock()
+
+    def api_call(self, method, **kwargs):
+        # Make a Web API call, waiting and retrying up to max_retries times
+        # if we are rate limited, then returning the last response
+        attempts = 0
+        while True:
+            response = self.slack_client.api_call(method, **kwargs)
+            attempts += 1
+            if response.get('error') != 'ratelimited' or attempts > self.max_retries:
+                return response
+            time.sleep(get_retry_after(response))
+
+    def store_member(self, member, cached_time=None):
+        # Add or replace the directory entry for a users.list/users.info member
+        userid = member.get('id')
+        username = member.get('name')
+        if not (userid and username):
+            return
+        if cached_time is None:
+            cached_time = time.time()
+        with self.lock:
+            self.users[userid] = (username, cached_time)
+
+    def load(self):
+        # Load every member of the workspace, one users.list page at a time
+        # Returns True on success, False if any page could not be fetched
+        cached_time = time.time()
+        cursor = ''
+        while True:
+            if cursor:
+                response = self.api_call('users.list', limit=self.page_size, cursor=cursor)
+            else:
+                response = self.api_call('users.list', limit=self.page_size)
+            if not response.get('ok'):
+                return False
+            for member in response.get('members', []):
+                self.store_member(member, cached_time)
+            cursor = response.get('response_metadata', {}).get('next_cursor', '')
+            if not cursor:
+                return True
+
+    def update_from_event(self, event):
+        # Refresh the directory from RTM events which carry a user object
+        if event.get('type') in ('user_change', 'team_join'):
+            member = event.get('user')
+            if isinstance(member, dict):
+                self.store_member(member)
+
+    def fetch_user_name(self, userid):
+        # Look up a single user with users.info, return None if not found or error
+        response = self.api_call('users.info', user=userid)
+        if response.get('ok'):
+            member = response.get('user', {})
+            self.store_member(member)
+            return member.get('name')
+        return None
+
+    def lookup(self, userid):
+        # Returns the user name for userid, None if not found or error
+        with self.lock:
+            entry = self.users.get(userid)
+        if entry and time.time() - entry[1] < self.ttl_secs:
+            return entry[0]
+        username = self.fetch_user_name(userid)
+        if username is None and entry:
+            # Stale is better than nothing if Slack didn't answer
+            return entry[0]
+        return username
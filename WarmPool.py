@@ -0,0 +1,122 @@
+"""
+WarmPool is a module containing the WarmPool, a pool of processes
+which have already been started and are waiting for a job.
+
+Each process runs exactly one job and is then discarded, while a
+background thread starts a replacement, so jobs don't wait for the
+process to start but never share a process with another job.
+
+Copyright (c) 2016 Donald E. Willcox
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import time
+import threading
+from collections import deque
+
+class WarmPool(object):
+    def __init__(self, spawn, size, verbose=False):
+        # Function which starts and returns a new Popen waiting for its job
+        self.spawn = spawn
+
+        # Number of idle processes to keep ready
+        self.size = size
+
+        # Verbose status
+        self.verbose = verbose
+
+        # Idle processes, oldest first
+        self.idle = deque()
+        self.lock = threading.Lock()
+
+        # Counts of jobs which did and didn't find an idle process
+        self.hits = 0
+        self.misses = 0
+
+        # Seconds to wait before trying again if a process fails to start
+        self.retry_delay = 5
+
+        # Background thread which keeps the pool full
+        self.refill_needed = threading.Event()
+        self.running = True
+        self.refill_thread = threading.Thread(target=self.refill_loop,
+                                              name='artoo-warm-pool', daemon=True)
+        self.refill_thread.start()
+        self.refill_needed.set()
+
+    def print_wrapper(self, to_print):
+        # Wrapper for python print that checks verbosity status
+        if self.verbose:
+            print(to_print)
+
+    def refill_loop(self):
+        # Start processes until there are self.size idle ones, then wait to be needed
+        while self.running:
+            self.refill_needed.wait()
+            self.refill_needed.clear()
+            while self.running and self.num_idle() < self.size:
+                try:
+                    proc = self.spawn()
+                except OSError as err:
+                    print('Could not start a warm process: {}'.format(err))
+                    time.sleep(self.retry_delay)
+                    continue
+                with self.lock:
+                    if self.running:
+                        self.idle.append(proc)
+                        continue
+                # Shut down while this process was starting
+                proc.kill()
+                proc.wait()
+
+    def num_idle(self):
+        # Returns the number of idle processes
+        with self.lock:
+            return len(self.idle)
+
+    def acquire(self):
+        # Returns an idle process for one job, or None if none are ready
+        proc = None
+        with self.lock:
+            while self.idle:
+                candidate = self.idle.popleft()
+                if candidate.poll() is None:
+                    proc = candidate
+                    break
+            if proc:
+                self.hits += 1
+            else:
+                self.misses += 1
+            hits, misses = self.hits, self.misses
+        # Replace the process we took (or start filling the empty pool)
+        self.refill_needed.set()
+        self.print_wrapper('Warm pool {}: {} hits, {} misses'.format(
+            'hit' if proc else 'miss', hits, misses))
+        return proc
+
+    def shutdown(self):
+        # Stop refilling and kill the idle processes
+        self.running = False
+        self.refill_needed.set()
+        with self.lock:
+            while self.idle:
+                proc = self.idle.popleft()
+                proc.kill()
+                proc.wait()
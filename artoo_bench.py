@@ -0,0 +1,240 @@
+"""
+Artoo Benchmark
+
+Runs Artoo against a local FakeSlack and reports its throughput and
+the latency from delivering each tagged message to posting its reply.
+
+Messages come from a trace file (JSON Lines with a 't' offset in
+seconds and a 'message' on each line) or are generated from a mix of
+help requests, python and bash code, code snippet files and untagged
+chatter. Generated code runs without the SELinux sandbox unless -sandbox
+is given. Traces may hold anyone's code, so -trace also needs -sandbox,
+or -no-sandbox to run it unsandboxed anyway.
+
+Copyright (c) 2016 Donald E. Willcox
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import os
+import gzip
+import json
+import time
+import random
+import argparse
+import tempfile
+import threading
+from Artoo import Artoo
+from Metrics import Metrics
+from Sandbox import Sandbox
+from RemoteExecutor import ExecutorWorker
+from FakeSlack import FakeSlack, FakeSlackMixin
+
+class FakeArtoo(FakeSlackMixin, Artoo):
+    pass
+
+PYTHON_SNIPPETS = ['print("Hello, world!")',
+                   'print(sum(i*i for i in range(100000)))',
+                   'import math\nprint([math.factorial(n) for n in range(20)])',
+                   'primes = [n for n in range(2, 5000) if all(n % d for d in range(2, int(n**0.5) + 1))]\nprint(len(primes))']
+
+BASH_SNIPPETS = ['echo "Hello, world!"',
+                 'for i in 1 2 3; do echo $i; done',
+                 'seq 1 1000 | paste -sd+ | bc']
+
+def parse_mix(mix_text):
+    # Parse 'kind=weight,...' into a dictionary
+    mix = {}
+    for item in mix_text.split(','):
+        kind, weight = item.split('=')
+        mix[kind.strip()] = float(weight)
+    return mix
+
+def make_synthetic_trace(fake_slack, num_messages, rate, mix, rng):
+    # Returns a list of (offset seconds, message) with kinds drawn from mix
+    # Each message is in its own channel so replies can be matched to it
+    kinds = list(mix)
+    weights = [mix[kind] for kind in kinds]
+    user_ids = sorted(fake_slack.users)
+    trace = []
+    for i in range(num_messages):
+        kind = rng.choices(kinds, weights)[0]
+        message = {'type': 'message', 'channel': 'C{:06d}'.format(i), 'user': rng.choice(user_ids)}
+        if kind == 'help':
+            message['text'] = '{} help'.format(fake_slack.tag)
+        elif kind == 'python':
+            message['text'] = '{} python\n```\n{}\n```'.format(fake_slack.tag, rng.choice(PYTHON_SNIPPETS))
+        elif kind == 'bash':
+            message['text'] = '{} bash\n```\n{}\n```'.format(fake_slack.tag, rng.choice(BASH_SNIPPETS))
+        elif kind == 'file':
+            message['text'] = '{} python'.format(fake_slack.tag)
+            message['file'] = fake_slack.add_file(rng.choice(PYTHON_SNIPPETS))
+        else:
+            message['text'] = 'Just chatting, nothing for the bot here.'
+        offset = i/rate if rate > 0 else 0
+        trace.append((offset, message))
+    return trace
+
+def read_trace(trace_path):
+    # Yields the records of a JSON Lines trace, which may be compressed with gzip
+    if trace_path.endswith('.gz'):
+        fid = gzip.open(trace_path, 'rt', encoding='utf-8')
+    else:
+        fid = open(trace_path, 'r', encoding='utf-8')
+    with fid:
+        for line in fid:
+            if line.strip():
+                yield json.loads(line)
+
+def load_trace(fake_slack, trace_paths, bot_id, own_channels=True):
+    # Returns a list of (offset seconds, message) read from JSON Lines traces
+    # (such as event logs and their rotated files) in time order. Tags of
+    # bot_id are retargeted to the fake bot, tagged messages each get their
+    # own channel (if own_channels), and lines with 'file_content' share it as a file
+    records = []
+    for trace_path in trace_paths:
+        records.extend(read_trace(trace_path))
+    records.sort(key=lambda record: record.get('t', 0))
+    trace = []
+    first_t = None
+    for record in records:
+        message = record['message']
+        if bot_id and 'text' in message:
+            message['text'] = message['text'].replace('<@{}>'.format(bot_id), fake_slack.tag)
+        if 'file_content' in record:
+            message['file'] = fake_slack.add_file(record['file_content'])
+        if own_channels and fake_slack.is_tagged(message):
+            message['channel'] = 'C{:06d}'.format(len(trace))
+        t = record.get('t', 0)
+        if first_t is None:
+            first_t = t
+        trace.append((t - first_t, message))
+    return trace
+
+# Secret shared by the benchmark's executor workers and its bot
+BENCH_EXECUTOR_SECRET = 'artoo-bench'
+
+def percentile(values, fraction):
+    # Returns the nearest-rank percentile of a sorted list of values
+    if not values:
+        return float('nan')
+    rank = max(0, min(len(values) - 1, int(round(fraction*len(values) + 0.5)) - 1))
+    return values[rank]
+
+def start_executors(args, address):
+    # Start args.executors executor workers on threads of this process,
+    # connected to the bot's RemoteExecutor at address
+    for i in range(args.executors):
+        sandbox = Sandbox(Metrics(), args.verbose, use_sandbox=args.sandbox,
+                          diskless=args.diskless, warm_pool_size=args.warm)
+        worker = ExecutorWorker(sandbox, address, BENCH_EXECUTOR_SECRET, args.executor_jobs,
+                                name='bench-{}'.format(i), verbose=args.verbose)
+        threading.Thread(target=worker.run, daemon=True).start()
+
+def run_benchmark(args):
+    # Run Artoo against a FakeSlack playing the trace and print a report
+    # With several workspaces, each gets its own FakeSlack, trace and Artoo,
+    # and the Artoos share the first one's job pool and sandbox
+    rng = random.Random(args.seed)
+    fake_slacks, artoos, traces = [], [], []
+    for workspace in range(args.workspaces):
+        fake_slack = FakeSlack(bot_id='UARTOO' if workspace == 0 else 'UARTOO{}'.format(workspace),
+                               api_latency=args.api_latency)
+        id_file = fake_slack.write_id_file(os.path.join(tempfile.mkdtemp(), '.artoo'))
+        artoo = FakeArtoo(id_file, False, args.verbose, args.workers,
+                          warm_pool_size=args.warm, cache_results=args.cache,
+                          stream_output=args.stream, use_sandbox=args.sandbox,
+                          diskless=args.diskless,
+                          executor_address='127.0.0.1:0' if args.executors else None,
+                          executor_secret=BENCH_EXECUTOR_SECRET,
+                          shared_from=artoos[0] if artoos else None)
+        artoo.use_fake_slack(fake_slack)
+        artoo.poll_delay = args.poll_delay
+        if args.trace:
+            trace = load_trace(fake_slack, [args.trace], args.trace_bot_id)
+        else:
+            trace = make_synthetic_trace(fake_slack, args.count, args.rate, parse_mix(args.mix), rng)
+        fake_slacks.append(fake_slack)
+        artoos.append(artoo)
+        traces.append(trace)
+    artoo = artoos[0]
+    if args.executors:
+        start_executors(args, '{}:{}'.format(*artoo.executor.address))
+    num_tagged = [sum(1 for offset, message in trace if fake_slack.is_tagged(message))
+                  for fake_slack, trace in zip(fake_slacks, traces)]
+
+    # Start the bots and give them a moment to connect and load users
+    if args.use_async:
+        bot_loops = [lambda: artoo.run_event_loop(artoos[1:])]
+    else:
+        bot_loops = [each_artoo.poll_slack for each_artoo in artoos]
+    for bot_loop in bot_loops:
+        threading.Thread(target=bot_loop, name='artoo-bench-bot', daemon=True).start()
+    time.sleep(0.5)
+
+    start_time = time.time()
+    for fake_slack, trace in zip(fake_slacks, traces):
+        fake_slack.play(trace)
+    finished = True
+    for fake_slack, workspace_tagged in zip(fake_slacks, num_tagged):
+        remaining = max(0, start_time + args.timeout - time.time())
+        finished = fake_slack.wait_for_replies(workspace_tagged, remaining) and finished
+    elapsed = time.time() - start_time
+
+    latencies = sorted(latency for fake_slack in fake_slacks for latency in fake_slack.latencies)
+    if args.workspaces > 1:
+        print('Workspaces:      {}'.format(args.workspaces))
+    print('Messages:        {} ({} tagged)'.format(sum(len(trace) for trace in traces), sum(num_tagged)))
+    print('Replies:         {}{}'.format(len(latencies), '' if finished else ' (timed out)'))
+    print('Elapsed:         {:.3f} s'.format(elapsed))
+    print('Throughput:      {:.2f} requests/s'.format(len(latencies)/elapsed))
+    for label, fraction in [('p50', 0.50), ('p95', 0.95), ('p99', 0.99)]:
+        print('Latency {}:     {:.3f} s'.format(label, percentile(latencies, fraction)))
+    if latencies:
+        print('Latency max:     {:.3f} s'.format(latencies[-1]))
+    for fake_slack in fake_slacks:
+        fake_slack.shutdown()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-trace', '--trace', type=str, default=None, help='JSON Lines trace of messages to replay instead of generating messages.')
+    parser.add_argument('-trace-bot-id', '--trace-bot-id', type=str, default=None, help='Bot ID tagged in the trace, retargeted to the fake bot.')
+    parser.add_argument('-count', '--count', type=int, default=100, help='Number of messages to generate (default 100).')
+    parser.add_argument('-rate', '--rate', type=float, default=0, help='Messages per second to generate, 0 to send them all at once (default 0).')
+    parser.add_argument('-mix', '--mix', type=str, default='help=1,python=4,bash=2,file=1,chatter=2', help='Relative weights of generated message kinds.')
+    parser.add_argument('-seed', '--seed', type=int, default=0, help='Random seed for generated messages.')
+    parser.add_argument('-timeout', '--timeout', type=float, default=300, help='Seconds to wait for all replies (default 300).')
+    parser.add_argument('-api-latency', '--api-latency', type=float, default=0, help='Seconds each fake Web API call takes (default 0).')
+    parser.add_argument('-poll-delay', '--poll-delay', type=float, default=1, help='Polling delay of the bot in seconds (default 1).')
+    parser.add_argument('-async', '--async', dest='use_async', action='store_true', help='Run the bot with its asyncio event loop.')
+    parser.add_argument('-workspaces', '--workspaces', type=int, default=1, help='Number of workspaces served by one process, each playing its own trace (default 1).')
+    parser.add_argument('-workers', '--workers', type=int, default=4, help='Number of jobs to run concurrently (default 4).')
+    parser.add_argument('-warm', '--warm', type=int, default=0, help='Number of warm python interpreters (default 0).')
+    parser.add_argument('-cache', '--cache', action='store_true', help='Enable the result cache.')
+    parser.add_argument('-stream', '--stream', action='store_true', help='Stream output while code runs.')
+    parser.add_argument('-diskless', '--diskless', action='store_true', help='Pass code to interpreters on stdin.')
+    parser.add_argument('-executors', '--executors', type=int, default=0, help='Run jobs on this many executor workers instead of in the bot (default 0).')
+    parser.add_argument('-executor-jobs', '--executor-jobs', type=int, default=1, help='Jobs each executor worker runs concurrently (default 1).')
+    parser.add_argument('-sandbox', '--sandbox', action='store_true', help='Run code in the SELinux sandbox.')
+    parser.add_argument('-no-sandbox', '--no-sandbox', action='store_true', help='Run the code in a trace without the SELinux sandbox. UNSAFE: only for traces you trust.')
+    parser.add_argument('-v', '--verbose', action='store_true', help='Print an activity log to console.')
+    args = parser.parse_args()
+    if args.trace and not (args.sandbox or args.no_sandbox):
+        parser.error('a trace may hold anyone\'s code: give -sandbox, or -no-sandbox to run it unsandboxed')
+    run_benchmark(args)
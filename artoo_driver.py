@@ -22,13 +22,96 @@ SOFTWARE.
 
 # Artoo Driver
 import argparse
+import threading
 from Artoo import Artoo
+from RemoteExecutor import read_secret
+from EventLog import EventLog
 
 parser = argparse.ArgumentParser()
-parser.add_argument('idfile', type=str, help='Bot identity file from which to read the Bot ID and Token.')
+parser.add_argument('idfile', type=str, nargs='+', help='Bot identity file from which to read the Bot ID and Token. Give one for each workspace to serve them all from this process.')
 parser.add_argument('-watch', '--watch', action='store_true', help='Watch all slack messages and print them to the console.')
 parser.add_argument('-v', '--verbose', action='store_true', help='Print an activity log to console.')
+parser.add_argument('-async', '--async', dest='use_async', action='store_true', help='Run an event-driven asyncio loop instead of polling Slack.')
+parser.add_argument('-workers', '--workers', type=int, default=4, help='Number of jobs to run concurrently (default 4).')
+parser.add_argument('-warm', '--warm', type=int, default=0, help='Number of sandboxed python interpreters to keep started ahead of time (default 0, disabled).')
+parser.add_argument('-prewarm', '--prewarm', type=str, default='', help='Comma-separated python modules for warm interpreters to import ahead of time, e.g. numpy,scipy.')
+parser.add_argument('-cache', '--cache', action='store_true', help='Reply to repeated code from a cache of earlier results.')
+parser.add_argument('-cache-ttl', '--cache-ttl', type=float, default=3600, help='Seconds to keep cached results (default 3600).')
+parser.add_argument('-cache-mb', '--cache-mb', type=float, default=64, help='Total size of cached output in MB (default 64).')
+parser.add_argument('-stream', '--stream', action='store_true', help='Show output in Slack while code is still running.')
+parser.add_argument('-stream-interval', '--stream-interval', type=float, default=3, help='Seconds between updates of streamed output (default 3).')
+parser.add_argument('-limit-mem', '--limit-mem', type=float, default=None, help='Address space limit for each job in MB.')
+parser.add_argument('-limit-cpu', '--limit-cpu', type=int, default=None, help='CPU time limit for each job in seconds.')
+parser.add_argument('-limit-procs', '--limit-procs', type=int, default=None, help='Process limit for jobs (counts every process of the user running Artoo).')
+parser.add_argument('-limit-output', '--limit-output', type=float, default=None, help='Halt jobs which write more than this many MB of output.')
+parser.add_argument('-runtime', '--runtime', type=str, default=None, help='Sandbox runtime installed with artoo_provision.py to run code with (default sbox_home/sbox_anaconda).')
+parser.add_argument('-diskless', '--diskless', action='store_true', help='Pass code to interpreters on stdin instead of writing temporary files.')
+parser.add_argument('-no-preflight', '--no-preflight', action='store_true', help='Run code without checking its size and syntax first.')
+parser.add_argument('-no-sandbox', '--no-sandbox', action='store_true', help='Run code without the SELinux sandbox. UNSAFE: for development only.')
+parser.add_argument('-max-queued', '--max-queued', type=int, default=100, help='Most jobs waiting to run before new ones are turned away (default 100).')
+parser.add_argument('-user-jobs', '--user-jobs', type=int, default=2, help='Most jobs running at once for each user (default 2).')
+parser.add_argument('-channel-jobs', '--channel-jobs', type=int, default=4, help='Most jobs running at once in each channel (default 4).')
+parser.add_argument('-sessions', '--sessions', type=int, default=4, help='Most persistent python sessions alive at once (default 4, 0 to disable).')
+parser.add_argument('-session-idle', '--session-idle', type=float, default=900, help='Seconds before an idle session is ended (default 900).')
+parser.add_argument('-session-mb', '--session-mb', type=float, default=None, help='Memory in MB all sessions together may use before idle ones are ended.')
+parser.add_argument('-executor-listen', '--executor-listen', type=str, default=None, help='Run jobs on executor workers connecting to HOST:PORT instead of on this host.')
+parser.add_argument('-executor-secret', '--executor-secret', type=str, default=None, help='File holding the secret executor workers must present (required with -executor-listen).')
+parser.add_argument('-event-log', '--event-log', type=str, default=None, help='Record every message read from Slack in this JSON Lines file (in watch mode, the default is stdout).')
+parser.add_argument('-log-mb', '--log-mb', type=float, default=64, help='Size in MB at which the event log is rotated (default 64).')
+parser.add_argument('-log-backups', '--log-backups', type=int, default=5, help='Number of rotated event logs to keep (default 5).')
+parser.add_argument('-log-gzip', '--log-gzip', action='store_true', help='Compress rotated event logs with gzip.')
+parser.add_argument('-metrics-port', '--metrics-port', type=int, default=0, help='Serve Prometheus metrics at http://127.0.0.1:PORT/metrics (default 0, disabled).')
 args = parser.parse_args()
 
-artoo = Artoo(args.idfile, args.watch, args.verbose)
-artoo.poll_slack()
+prewarm_modules = [m for m in args.prewarm.split(',') if m]
+limits = {'as': None, 'cpu': args.limit_cpu, 'nproc': args.limit_procs, 'output': None}
+if args.limit_mem is not None:
+    limits['as'] = int(args.limit_mem*1024*1024)
+if args.limit_output is not None:
+    limits['output'] = int(args.limit_output*1024*1024)
+session_memory = None
+if args.session_mb is not None:
+    session_memory = int(args.session_mb*1024*1024)
+executor_secret = None
+if args.executor_listen:
+    if not args.executor_secret:
+        parser.error('-executor-listen requires -executor-secret')
+    executor_secret = read_secret(args.executor_secret)
+# The first Artoo's job pool, sandbox and limits are shared by the others
+artoos = []
+for idfile in args.idfile:
+    artoo = Artoo(idfile, args.watch, args.verbose, args.workers,
+                  warm_pool_size=args.warm, prewarm_modules=prewarm_modules,
+                  cache_results=args.cache, cache_ttl=args.cache_ttl,
+                  cache_bytes=int(args.cache_mb*1024*1024),
+                  stream_output=args.stream, stream_interval=args.stream_interval,
+                  limits=limits, use_sandbox=not args.no_sandbox, diskless=args.diskless,
+                  executor_address=args.executor_listen, executor_secret=executor_secret,
+                  max_sessions=args.sessions, session_idle_secs=args.session_idle,
+                  session_memory=session_memory, max_queued=args.max_queued,
+                  user_quota=args.user_jobs, channel_quota=args.channel_jobs,
+                  preflight=not args.no_preflight, runtime=args.runtime,
+                  shared_from=artoos[0] if artoos else None)
+    artoos.append(artoo)
+artoo = artoos[0]
+if args.event_log or args.watch:
+    event_log = EventLog(args.event_log, max_bytes=int(args.log_mb*1024*1024),
+                         backups=args.log_backups, compress=args.log_gzip)
+    for each_artoo in artoos:
+        each_artoo.event_log = event_log
+    artoo.metrics.register_gauge('artoo_event_log_dropped', lambda: event_log.num_dropped,
+                                 'Messages dropped because the event log fell behind.')
+if args.metrics_port:
+    artoo.metrics.start_http_server(args.metrics_port)
+try:
+    if args.use_async:
+        # One event loop serves every workspace
+        artoo.run_event_loop(artoos[1:])
+    else:
+        # Each workspace polls Slack on its own thread
+        for other_artoo in artoos[1:]:
+            threading.Thread(target=other_artoo.poll_slack, daemon=True).start()
+        artoo.poll_slack()
+finally:
+    if artoo.event_log:
+        artoo.event_log.close()
@@ -0,0 +1,63 @@
+"""
+Copyright (c) 2016 Donald E. Willcox
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+# Artoo Executor Worker
+import argparse
+from Metrics import Metrics
+from Sandbox import Sandbox
+from RemoteExecutor import ExecutorWorker, read_secret
+
+parser = argparse.ArgumentParser()
+parser.add_argument('address', type=str, help='HOST:PORT where Artoo listens for executor workers (its -executor-listen).')
+parser.add_argument('-secret', '--secret', type=str, required=True, help='File holding the secret shared with Artoo.')
+parser.add_argument('-jobs', '--jobs', type=int, default=1, help='Number of jobs to run concurrently (default 1).')
+parser.add_argument('-name', '--name', type=str, default=None, help='Name reported to Artoo (default the host name).')
+parser.add_argument('-v', '--verbose', action='store_true', help='Print an activity log to console.')
+parser.add_argument('-warm', '--warm', type=int, default=0, help='Number of sandboxed python interpreters to keep started ahead of time (default 0, disabled).')
+parser.add_argument('-prewarm', '--prewarm', type=str, default='', help='Comma-separated python modules for warm interpreters to import ahead of time, e.g. numpy,scipy.')
+parser.add_argument('-stream-interval', '--stream-interval', type=float, default=1, help='Seconds between reports of output while code runs (default 1).')
+parser.add_argument('-limit-mem', '--limit-mem', type=float, default=None, help='Address space limit for each job in MB.')
+parser.add_argument('-limit-cpu', '--limit-cpu', type=int, default=None, help='CPU time limit for each job in seconds.')
+parser.add_argument('-limit-procs', '--limit-procs', type=int, default=None, help='Process limit for jobs (counts every process of the user running the worker).')
+parser.add_argument('-limit-output', '--limit-output', type=float, default=None, help='Halt jobs which write more than this many MB of output.')
+parser.add_argument('-runtime', '--runtime', type=str, default=None, help='Sandbox runtime installed with artoo_provision.py to run code with (default sbox_home/sbox_anaconda).')
+parser.add_argument('-diskless', '--diskless', action='store_true', help='Pass code to interpreters on stdin instead of writing temporary files.')
+parser.add_argument('-no-sandbox', '--no-sandbox', action='store_true', help='Run code without the SELinux sandbox. UNSAFE: for development only.')
+parser.add_argument('-metrics-port', '--metrics-port', type=int, default=0, help='Serve Prometheus metrics at http://127.0.0.1:PORT/metrics (default 0, disabled).')
+args = parser.parse_args()
+
+prewarm_modules = [m for m in args.prewarm.split(',') if m]
+limits = {'as': None, 'cpu': args.limit_cpu, 'nproc': args.limit_procs, 'output': None}
+if args.limit_mem is not None:
+    limits['as'] = int(args.limit_mem*1024*1024)
+if args.limit_output is not None:
+    limits['output'] = int(args.limit_output*1024*1024)
+metrics = Metrics()
+sandbox = Sandbox(metrics, args.verbose, limits, use_sandbox=not args.no_sandbox,
+                  diskless=args.diskless, warm_pool_size=args.warm,
+                  prewarm_modules=prewarm_modules, stream_interval=args.stream_interval,
+                  runtime=args.runtime)
+if args.metrics_port:
+    metrics.start_http_server(args.metrics_port)
+worker = ExecutorWorker(sandbox, args.address, read_secret(args.secret), args.jobs,
+                        name=args.name, verbose=args.verbose)
+worker.run()
@@ -0,0 +1,76 @@
+"""
+Copyright (c) 2016 Donald E. Willcox
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+# Artoo Sandbox Runtime Provisioning
+import sys
+import argparse
+from RuntimeStore import RuntimeStore
+
+parser = argparse.ArgumentParser(description='Build read-only sandbox runtimes from a content addressed store.')
+parser.add_argument('-store', '--store', type=str, default='runtime_store', help='Directory of the runtime store (default runtime_store).')
+parser.add_argument('-runtimes', '--runtimes', type=str, default='sbox_home/runtimes', help='Directory to install runtimes in, on the same filesystem as the store (default sbox_home/runtimes).')
+parser.add_argument('-v', '--verbose', action='store_true', help='Print an activity log to console.')
+subparsers = parser.add_subparsers(dest='command')
+parser_add = subparsers.add_parser('add', help='Store the files of a python distribution (or other runtime) and install it.')
+parser_add.add_argument('name', type=str, help='Name of the runtime, e.g. py311.')
+parser_add.add_argument('source', type=str, help='Directory to store, e.g. ~/anaconda3.')
+parser_add.add_argument('-no-install', '--no-install', action='store_true', help='Only store the runtime, without installing it.')
+parser_install = subparsers.add_parser('install', help='Install (or reinstall) stored runtimes by hard linking their files.')
+parser_install.add_argument('names', type=str, nargs='*', help='Runtimes to install (default all).')
+subparsers.add_parser('list', help='List the stored runtimes.')
+parser_remove = subparsers.add_parser('remove', help='Uninstall runtimes and forget them.')
+parser_remove.add_argument('names', type=str, nargs='+', help='Runtimes to remove.')
+subparsers.add_parser('gc', help='Delete stored files which no runtime uses.')
+parser_verify = subparsers.add_parser('verify', help='Check stored and installed runtime files for changes.')
+parser_verify.add_argument('names', type=str, nargs='*', help='Runtimes to verify (default all).')
+args = parser.parse_args()
+
+store = RuntimeStore(args.store, args.runtimes, verbose=args.verbose)
+if args.command == 'add':
+    store.add(args.name, args.source)
+    if not args.no_install:
+        store.install(args.name)
+elif args.command == 'install':
+    for name in args.names or store.list_names():
+        store.install(name)
+elif args.command == 'list':
+    for name in store.list_names():
+        print(store.describe(name))
+elif args.command == 'remove':
+    for name in args.names:
+        store.remove(name)
+elif args.command == 'gc':
+    num_files, num_bytes = store.gc()
+    print('Deleted {} unused files, {} MB'.format(num_files, round(num_bytes/1024/1024, 1)))
+elif args.command == 'verify':
+    num_problems = 0
+    for name in args.names or store.list_names():
+        problems = store.verify(name)
+        for problem in problems:
+            print('{}: {}'.format(name, problem))
+        num_problems += len(problems)
+        if not problems:
+            print('{}: OK'.format(name))
+    if num_problems:
+        sys.exit(1)
+else:
+    parser.print_help()
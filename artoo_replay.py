@@ -0,0 +1,108 @@
+"""
+Artoo Replay
+
+Replays messages recorded by Artoo's event log (-event-log, or -watch)
+to Artoo running against a local FakeSlack. The messages go through
+filter_tagged_messages and reply_tagged_message just as they did from
+Slack, keeping their users and channels, and the replies are printed or
+written as JSON Lines.
+
+Rotated logs (including gzipped ones) may be given together, and are
+replayed in time order. Recorded code runs in the SELinux sandbox
+unless -no-sandbox is given.
+
+Copyright (c) 2016 Donald E. Willcox
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import os
+import sys
+import json
+import time
+import tempfile
+import argparse
+import threading
+from FakeSlack import FakeSlack
+from artoo_bench import FakeArtoo, load_trace
+
+def replay_logs(args):
+    # Replay the logs to Artoo and print or record its replies
+    fake_slack = FakeSlack(bot_id=args.bot_id or 'UARTOO')
+    id_file = fake_slack.write_id_file(os.path.join(tempfile.mkdtemp(), '.artoo'))
+    artoo = FakeArtoo(id_file, False, args.verbose, args.workers,
+                      cache_results=args.cache, use_sandbox=not args.no_sandbox,
+                      diskless=args.diskless)
+    artoo.use_fake_slack(fake_slack)
+    artoo.poll_delay = args.poll_delay
+
+    trace = load_trace(fake_slack, args.logs, args.bot_id, own_channels=False)
+    if args.speed > 0:
+        trace = [(offset/args.speed, message) for offset, message in trace]
+    else:
+        trace = [(0, message) for offset, message in trace]
+    num_tagged = sum(1 for offset, message in trace if fake_slack.is_tagged(message))
+
+    if args.use_async:
+        bot_loop = artoo.run_event_loop
+    else:
+        bot_loop = artoo.poll_slack
+    threading.Thread(target=bot_loop, name='artoo-replay-bot', daemon=True).start()
+    time.sleep(0.5)
+
+    start_time = time.time()
+    fake_slack.play(trace)
+    finished = fake_slack.wait_for_replies(num_tagged, args.timeout)
+    elapsed = time.time() - start_time
+
+    if args.out:
+        fout = open(args.out, 'w', encoding='utf-8')
+    else:
+        fout = sys.stdout
+    for t, method, kwargs in list(fake_slack.api_log):
+        if method not in ('chat.postMessage', 'chat.update'):
+            continue
+        if args.out:
+            fout.write(json.dumps({'t': t - start_time, 'method': method,
+                                   'channel': kwargs.get('channel'),
+                                   'text': kwargs.get('text')}) + '\n')
+        else:
+            fout.write('---------------------- {} {}\n{}\n'.format(method, kwargs.get('channel'), kwargs.get('text')))
+    if args.out:
+        fout.close()
+    print('Replayed {} messages ({} tagged) in {:.3f} s, {} answered{}'.format(
+        len(trace), num_tagged, elapsed, len(fake_slack.latencies),
+        '' if finished else ' (timed out)'), file=sys.stderr)
+    fake_slack.shutdown()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('logs', nargs='+', help='Event logs to replay, e.g. events.jsonl.2.gz events.jsonl.1.gz events.jsonl')
+    parser.add_argument('-bot-id', '--bot-id', type=str, default=None, help='Bot ID tagged in the logs (default: tags of UARTOO only).')
+    parser.add_argument('-speed', '--speed', type=float, default=0, help='Replay this many times faster than recorded, 0 to send everything at once (default 0).')
+    parser.add_argument('-out', '--out', type=str, default=None, help='Write the replies to this JSON Lines file instead of printing them.')
+    parser.add_argument('-timeout', '--timeout', type=float, default=300, help='Seconds to wait for all replies (default 300).')
+    parser.add_argument('-poll-delay', '--poll-delay', type=float, default=0.1, help='Polling delay of the bot in seconds (default 0.1).')
+    parser.add_argument('-async', '--async', dest='use_async', action='store_true', help='Run the bot with its asyncio event loop.')
+    parser.add_argument('-workers', '--workers', type=int, default=4, help='Number of jobs to run concurrently (default 4).')
+    parser.add_argument('-cache', '--cache', action='store_true', help='Enable the result cache.')
+    parser.add_argument('-diskless', '--diskless', action='store_true', help='Pass code to interpreters on stdin.')
+    parser.add_argument('-no-sandbox', '--no-sandbox', action='store_true', help='Run the recorded code without the SELinux sandbox. UNSAFE: only for logs you trust.')
+    parser.add_argument('-v', '--verbose', action='store_true', help='Print an activity log to console.')
+    replay_logs(parser.parse_args())